@@ -0,0 +1,159 @@
+"""Typed conversation analysis results and the JSON schemas Gemini fills in."""
+import json
+from dataclasses import asdict, dataclass
+
+CATEGORIES = ('tone', 'engagement', 'resolution', 'information', 'overall')
+SUMMARY_FIELDS = ('conversation_summary', 'about_young_person')
+# Scored for each exchange in rolling evaluation; overall is only given at the end
+TURN_CATEGORIES = CATEGORIES[:-1]
+
+SCORED_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'score': {'type': 'integer'},
+        'feedback': {'type': 'string'},
+    },
+    'required': ['score', 'feedback'],
+}
+
+ANALYSIS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'conversation_summary': {'type': 'string'},
+        'about_young_person': {'type': 'string'},
+        **{category: SCORED_SCHEMA for category in CATEGORIES},
+    },
+    'required': ['conversation_summary', 'about_young_person', *CATEGORIES],
+}
+
+# Fan-out: each dimension fills in SCORED_SCHEMA, and one request the summary
+SUMMARY_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'conversation_summary': {'type': 'string'},
+        'about_young_person': {'type': 'string'},
+    },
+    'required': ['conversation_summary', 'about_young_person'],
+}
+
+TURN_NOTE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'summary': {'type': 'string'},
+        **{category: SCORED_SCHEMA for category in TURN_CATEGORIES},
+    },
+    'required': ['summary', *TURN_CATEGORIES],
+}
+
+
+def parse_score(value):
+    """Coerce a model-supplied score ("85", 85.0, "85/100") to an int in 0-100."""
+    if isinstance(value, str):
+        value = value.strip().split('/')[0].rstrip('%').strip()
+    score = int(round(float(value)))
+    return max(0, min(100, score))
+
+
+@dataclass
+class ScoredFeedback:
+    score: int = 0
+    feedback: str = ''
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict) or 'score' not in data:
+            raise ValueError(f"Expected an object with score and feedback, got {data!r}")
+        return cls(score=parse_score(data['score']), feedback=str(data.get('feedback', '')).strip())
+
+
+def overall_from_dimensions(dimensions, labels):
+    """Overall ScoredFeedback computed locally from the other categories' scores."""
+    ranked = sorted(dimensions, key=lambda category: dimensions[category].score)
+    weakest, strongest = ranked[0], ranked[-1]
+    score = round(sum(feedback.score for feedback in dimensions.values()) / len(dimensions))
+    return ScoredFeedback(
+        score=score,
+        feedback=(
+            f"Average of the {len(dimensions)} areas. Strongest: {labels[strongest]} "
+            f"({dimensions[strongest].score}); most room to improve: {labels[weakest]} "
+            f"({dimensions[weakest].score})."
+        )
+    )
+
+
+@dataclass
+class AnalysisResult:
+    conversation_summary: str = ''
+    about_young_person: str = ''
+    tone: ScoredFeedback = None
+    engagement: ScoredFeedback = None
+    resolution: ScoredFeedback = None
+    information: ScoredFeedback = None
+    overall: ScoredFeedback = None
+
+    def __post_init__(self):
+        for category in CATEGORIES:
+            if getattr(self, category) is None:
+                setattr(self, category, ScoredFeedback())
+
+    @classmethod
+    def from_json(cls, text):
+        """Validate a JSON analysis response field by field.
+
+        Returns the result and a list of the fields that were missing or
+        invalid, which keep their defaults. Raises ValueError if the text is
+        not a JSON object at all.
+        """
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError('Analysis response is not a JSON object')
+        values, invalid = {}, []
+        for name in SUMMARY_FIELDS:
+            value = data.get(name)
+            if isinstance(value, str) and value.strip():
+                values[name] = value.strip()
+            else:
+                invalid.append(name)
+        for category in CATEGORIES:
+            try:
+                values[category] = ScoredFeedback.from_dict(data.get(category))
+            except (TypeError, ValueError):
+                invalid.append(category)
+        return cls(**values), invalid
+
+    def to_dict(self):
+        """The dict shape returned by parse_analysis() and sent to the browser."""
+        return asdict(self)
+
+
+@dataclass
+class TurnNote:
+    """Notes on a single advisor/young person exchange."""
+    summary: str = ''
+    tone: ScoredFeedback = None
+    engagement: ScoredFeedback = None
+    resolution: ScoredFeedback = None
+    information: ScoredFeedback = None
+
+    def __post_init__(self):
+        for category in TURN_CATEGORIES:
+            if getattr(self, category) is None:
+                setattr(self, category, ScoredFeedback())
+
+    @classmethod
+    def from_json(cls, text):
+        """Raises ValueError unless every category is scored, so the note fails
+        and the exchange goes to the synthesis in full."""
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError('Turn note is not a JSON object')
+        missing = [category for category in TURN_CATEGORIES if category not in data]
+        if missing:
+            raise ValueError(f"Turn note is missing {', '.join(missing)}")
+        return cls(
+            summary=str(data.get('summary', '')).strip(),
+            **{category: ScoredFeedback.from_dict(data[category]) for category in TURN_CATEGORIES}
+        )
+
+    def to_dict(self):
+        return asdict(self)
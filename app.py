@@ -1,18 +1,37 @@
-from flask import Flask, render_template, request, jsonify, session, send_file
-import google.generativeai as genai
+from flask import Flask, render_template, request, jsonify, session, send_file, Response, stream_with_context, g
 import os
+import copy
+import json
+import re
+import time
 import random
+import uuid
 from dotenv import load_dotenv
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from io import BytesIO
 from datetime import datetime
+from difflib import SequenceMatcher
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from config import env_flag
+from session_store import ServerSideSessionInterface, create_session_store, load_secret_keys
+from persona_pool import PersonaPool
+import prompts
+from catalogue import StaleCatalogueError, load_catalogue
+from cache import LRUCache, DiskCache, TieredCache, content_key
+from jobs import JobWorkerPool, create_job_queue
+from analysis import (
+    ANALYSIS_SCHEMA, CATEGORIES, SCORED_SCHEMA, SUMMARY_FIELDS, SUMMARY_SCHEMA, TURN_CATEGORIES, TURN_NOTE_SCHEMA,
+    AnalysisResult, ScoredFeedback, TurnNote, overall_from_dimensions, parse_score
+)
+from pdf_renderer import PDFRenderer, PDFRendererBusyError, PDFRenderTimeoutError
+from llm import LLMResponse, create_provider
+from resilience import LLMUnavailableError, ResilientProvider
+from context_cache import ContextCachingProvider
+from singleflight import create_single_flight
+import metrics
+from metrics import span
+from io import BytesIO
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Required for session
 
 # Configure Flask to allow all connections
 app.config['SESSION_COOKIE_SECURE'] = False
@@ -22,487 +41,317 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 # Load environment variables
 load_dotenv()
 print("Environment variables loaded")
-print(f"GEMINI_API_KEY present: {'GEMINI_API_KEY' in os.environ}")
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
-
-# Possible themes and locations
-THEMES = {
-    "money": [
-        {
-            "issue": "struggling with bills at home",
-            "outcome": "get help with budgeting and find ways to reduce household expenses",
-            "details": "Parents are working multiple jobs but still struggling to make ends meet. Worried about having to move schools if we can't afford the rent."
-        },
-        {
-            "issue": "can't afford school trips",
-            "outcome": "find funding options or alternative ways to participate in school activities",
-            "details": "All my friends are going on the school trip to France but my family can't afford it. Feeling left out and embarrassed."
-        },
-        {
-            "issue": "worried about family's financial situation",
-            "outcome": "get advice on how to support my family and manage my own finances",
-            "details": "Parents are arguing about money all the time. I want to help but don't know how. Thinking about getting a part-time job."
-        },
-        {
-            "issue": "pressure to buy expensive things",
-            "outcome": "learn how to handle peer pressure and make responsible financial decisions",
-            "details": "Friends all have the latest phones and clothes. Feeling pressured to keep up but know my family can't afford it."
-        }
-    ],
-    "relationships": [
-        {
-            "issue": "problems with friends at school",
-            "outcome": "learn how to handle conflicts and rebuild friendships",
-            "details": "My best friend has started hanging out with a new group and is ignoring me. Feeling hurt and lonely."
-        },
-        {
-            "issue": "family arguments at home",
-            "outcome": "find ways to communicate better with my family and reduce arguments",
-            "details": "Constant arguments with parents about my future choices. They want me to go to university but I'm not sure."
-        },
-        {
-            "issue": "feeling left out of social groups",
-            "outcome": "build confidence to make new friends and feel included",
-            "details": "Moved to a new school and finding it hard to make friends. Everyone seems to have their own groups already."
-        },
-        {
-            "issue": "romantic relationship problems",
-            "outcome": "get advice on healthy relationships and boundaries",
-            "details": "First serious relationship and not sure if it's healthy. Partner is very controlling of who I can see."
-        },
-        {
-            "issue": "online friendship issues",
-            "outcome": "learn how to maintain healthy online relationships and set boundaries",
-            "details": "Made friends online but they're pressuring me to share personal information and photos."
-        }
-    ],
-    "mental health": [
-        {
-            "issue": "feeling really anxious lately",
-            "outcome": "learn coping strategies and find ways to manage my anxiety",
-            "details": "Getting panic attacks before exams and social situations. Can't sleep properly and always worrying."
-        },
-        {
-            "issue": "struggling with low mood",
-            "outcome": "get support and find activities that help improve my mood",
-            "details": "Feeling down all the time, no energy to do things I used to enjoy. Friends are worried about me."
-        },
-        {
-            "issue": "having panic attacks",
-            "outcome": "learn techniques to prevent and manage panic attacks",
-            "details": "Started having panic attacks in crowded places. Scared to go to school or social events."
-        },
-        {
-            "issue": "stress about future",
-            "outcome": "develop strategies to manage stress and make decisions about the future",
-            "details": "Overwhelmed with pressure to choose a career path. Don't know what I want to do and everyone keeps asking."
-        },
-        {
-            "issue": "body image concerns",
-            "outcome": "build positive body image and develop healthy habits",
-            "details": "Feeling self-conscious about my appearance. Social media makes me feel worse about how I look."
-        }
-    ],
-    "bullying": [
-        {
-            "issue": "being picked on at school",
-            "outcome": "get help to stop the bullying and feel safe at school",
-            "details": "Group of older students keep making fun of me and spreading rumors. Scared to tell teachers."
-        },
-        {
-            "issue": "receiving mean messages online",
-            "outcome": "learn how to handle online bullying and protect my privacy",
-            "details": "Getting anonymous messages on social media. They know personal things about me and I'm scared."
-        },
-        {
-            "issue": "excluded from friendship groups",
-            "outcome": "find ways to rebuild friendships or make new friends",
-            "details": "Friends have started a group chat without me and are ignoring me at school. Don't know what I did wrong."
-        },
-        {
-            "issue": "cyberbullying in gaming",
-            "outcome": "learn how to handle toxic behavior in online gaming",
-            "details": "Getting harassed in online games. People are making threats and sharing my personal information."
-        },
-        {
-            "issue": "workplace bullying",
-            "outcome": "get advice on handling workplace harassment",
-            "details": "Older colleagues at my part-time job are making inappropriate comments and excluding me from tasks."
-        }
-    ],
-    "family": [
-        {
-            "issue": "parents arguing a lot",
-            "outcome": "find ways to cope with family stress and improve home life",
-            "details": "Parents fight constantly about money and other issues. Worried they might split up."
-        },
-        {
-            "issue": "difficult relationship with step-parent",
-            "outcome": "build a better relationship with my step-parent",
-            "details": "New step-parent moved in and we don't get along. They're trying to parent me but I don't want them to."
-        },
-        {
-            "issue": "feeling ignored at home",
-            "outcome": "get help to communicate better with my family",
-            "details": "Parents are always busy with work and my younger siblings. Feel like they don't have time for me."
-        },
-        {
-            "issue": "cultural differences with family",
-            "outcome": "bridge cultural gaps and maintain family relationships",
-            "details": "Parents want me to follow traditional values but I want to live more like my friends. Causing lots of arguments."
-        },
-        {
-            "issue": "caring for family members",
-            "outcome": "balance caring responsibilities with personal life",
-            "details": "Looking after my younger siblings while parents work. Missing out on school activities and social life."
-        }
-    ],
-    "school": [
-        {
-            "issue": "falling behind in lessons",
-            "outcome": "get extra help with my studies and improve my grades",
-            "details": "Struggling to keep up with coursework. Teachers are putting pressure on me to do better."
-        },
-        {
-            "issue": "problems with a teacher",
-            "outcome": "resolve conflicts with my teacher and improve our relationship",
-            "details": "Teacher keeps picking on me and making negative comments. Other students notice and it's embarrassing."
-        },
-        {
-            "issue": "finding exams stressful",
-            "outcome": "learn study techniques and ways to manage exam stress",
-            "details": "Panic during exams and can't remember what I've learned. Worried about failing my GCSEs."
-        },
-        {
-            "issue": "choosing subjects",
-            "outcome": "make informed decisions about subject choices",
-            "details": "Need to choose A-level subjects but not sure what I want to do. Parents have different ideas."
-        },
-        {
-            "issue": "school attendance problems",
-            "outcome": "address barriers to regular school attendance",
-            "details": "Missing lots of school due to anxiety. Getting letters about attendance and worried about consequences."
-        }
-    ],
-    "identity": [
-        {
-            "issue": "exploring gender identity",
-            "outcome": "get support in understanding and expressing gender identity",
-            "details": "Questioning my gender identity but scared to talk to family. Friends are supportive but don't know how to help."
-        },
-        {
-            "issue": "coming out concerns",
-            "outcome": "navigate coming out process safely",
-            "details": "Want to come out to family but worried about their reaction. They make negative comments about LGBTQ+ people."
-        },
-        {
-            "issue": "cultural identity conflicts",
-            "outcome": "balance cultural heritage with personal identity",
-            "details": "Feeling torn between family's cultural expectations and wanting to fit in with friends at school."
-        },
-        {
-            "issue": "religious beliefs",
-            "outcome": "reconcile personal beliefs with family expectations",
-            "details": "Starting to question family's religious beliefs but scared to talk about it. Worried about being rejected."
-        }
-    ],
-    "health": [
-        {
-            "issue": "eating habits",
-            "outcome": "develop healthy relationship with food",
-            "details": "Struggling with irregular eating patterns. Sometimes skip meals, sometimes eat too much when stressed."
-        },
-        {
-            "issue": "sleep problems",
-            "outcome": "improve sleep habits and energy levels",
-            "details": "Can't sleep properly, always tired at school. Using phone late at night to avoid thinking about problems."
-        },
-        {
-            "issue": "physical health concerns",
-            "outcome": "address health concerns and access support",
-            "details": "Having unexplained symptoms but scared to tell parents. Worried it might be serious."
-        },
-        {
-            "issue": "substance use",
-            "outcome": "get support for reducing or stopping substance use",
-            "details": "Started using substances to cope with stress. Want to stop but finding it hard."
-        }
-    ]
-}
+# The session cookie is signed with a key shared by all workers and instances
+# (SECRET_KEY or SECRET_KEY_FILE); SECRET_KEY_FALLBACKS lists rotated-out keys
+# that are still accepted
+app.secret_key, app.config['SECRET_KEY_FALLBACKS'] = load_secret_keys()
 
-LOCATIONS = [
-    "Swansea", "Cardiff", "Newport", "Wrexham", "Bangor", "Aberystwyth",
-    "Carmarthen", "Rhyl", "Llanelli", "Porthmadog", "Aberdare", "Ebbw Vale",
-    "Brecon", "Abergavenny", "Caernarfon", "Haverfordwest", "Pontypridd", 
-    "Merthyr", "Ynysybwl", "Hay-on-Wye", "Llandrindod Wells", "Llanidloes",
-    "Aberdare", "Abercynon", "Aberkenfig", "Abertridwr", "Llandovery",
-    "Penarth", "Porthcawl", "Bridgend", "Tenby", "St. Clears", "St. Davids",
-    "Conwy", "Llandgollen", "Crickhowell", "Llandudno", "Chepstow", "Pontypool",
-    "Aberavon", "Aberdulais", "Aberfan", "Abercwmboi", "Neath", "Port Talbot", 
-    "Caernarfon", "Abergele", "Colwyn Bay", "Llanberis", "Harlech", "Portmeirion",
-    "Ruthin", "Machynlleth", "Dolgellau", "Holyhead", "Blaenau Ffestiniog", "Bala"
-]
-
-# Enhanced Welsh cultural elements
-WELSH_REFERENCES = {
-    "schools": [
-        "Ysgol Gyfun", "Welsh-medium school", "English-medium school with Welsh lessons",
-        "bilingual school", "Eisteddfod participant", "Urdd member",
-        "Welsh language stream", "Welsh heritage school", "Welsh culture club member",
-        "Welsh literature student", "Welsh history enthusiast", "Welsh music group member"
-    ],
-    "interests": [
-        "rugby", "football", "Welsh choir", "Welsh language learning",
-        "traditional Welsh dancing", "Eisteddfod competitions", "Welsh literature",
-        "Welsh history", "local Welsh festivals", "Welsh folk music",
-        "Welsh art and crafts", "Welsh poetry", "Welsh mythology",
-        "Welsh sports", "Welsh cooking", "Welsh environmental projects",
-        "Welsh community events", "Welsh media", "Welsh politics",
-        "Welsh cultural heritage"
-    ],
-    "family": [
-        "Welsh-speaking family", "mixed language household", "first language Welsh",
-        "learning Welsh as second language", "traditional Welsh family",
-        "modern Welsh family", "Welsh heritage family", "Welsh cultural family",
-        "Welsh community family", "Welsh diaspora family",
-        "Welsh-English bilingual family", "Welsh cultural traditions",
-        "Welsh family values", "Welsh family history"
-    ],
-    "communities": [
-        "Welsh language community", "Welsh cultural society", "Welsh youth group",
-        "Welsh sports club", "Welsh music group", "Welsh dance group",
-        "Welsh literature circle", "Welsh history society", "Welsh environmental group",
-        "Welsh community center", "Welsh cultural events", "Welsh heritage group"
-    ]
-}
+# Keep persona and conversation history server-side; the cookie only holds a session ID
+app.session_interface = ServerSideSessionInterface(create_session_store())
+print(f"Session backend: {os.getenv('SESSION_BACKEND', 'memory')}")
+print(f"GEMINI_API_KEY present: {'GEMINI_API_KEY' in os.environ}")
+
+# Configure the LLM provider: Gemini, or LLM_PROVIDER=fake for a local
+# stand-in used in load tests and benchmarks. Calls go through a layer of
+# timeouts, retries, a circuit breaker and a concurrency limit (LLM_* settings).
+# Static system instructions passed with a cache_key are context-cached by
+# the provider where it supports it (CONTEXT_CACHE_* settings).
+llm = ContextCachingProvider.from_env(ResilientProvider.from_env(create_provider()))
+# Coalesces duplicate in-flight model calls and analyses, per process or
+# (SINGLEFLIGHT_BACKEND=sqlite) across workers
+flights = create_single_flight()
+print(f"LLM provider: {llm.name}")
+
+def llm_generate(operation, contents, **kwargs):
+    # Identical calls in flight at the same time (a resent /chat, a retried
+    # analysis) share one upstream request
+    return flights.do(
+        content_key('llm', operation, contents, kwargs),
+        lambda: call_llm(operation, contents, **kwargs),
+        label=operation,
+        encode=lambda response: {'text': response.text, 'usage': response.usage},
+        decode=lambda data: LLMResponse(data['text'], data['usage'])
+    )
+
+# Optional cap on model calls made by this process, anything with an
+# acquire() that blocks until a call may go ahead (batch_score.py --rate).
+# Retries inside ResilientProvider are not counted separately.
+llm_rate_limiter = None
+
+def call_llm(operation, contents, **kwargs):
+    # Every model call is timed and its token usage counted under `operation`
+    if llm_rate_limiter is not None:
+        llm_rate_limiter.acquire()
+    try:
+        with span('llm_generate', operation=operation):
+            response = llm.generate(contents, **kwargs)
+    except Exception:
+        metrics.LLM_ERRORS.inc(operation=operation)
+        raise
+    metrics.record_usage(operation, response.usage)
+    return response
 
-# Youth interests (non-Welsh specific)
-YOUTH_INTERESTS = [
-    {
-        "category": "Digital & Online",
-        "interests": [
-            "gaming", "social media", "streaming content", "online influencers",
-            "memes & online humor", "podcasts", "photography & videography",
-            "digital art", "online communities", "virtual reality"
-        ]
-    },
-    {
-        "category": "Creative & Arts",
-        "interests": [
-            "music", "creative arts", "crafting & DIY", "reading", "writing",
-            "drawing", "painting", "digital design", "animation", "filmmaking"
-        ]
-    },
-    {
-        "category": "Physical & Social",
-        "interests": [
-            "sports & fitness", "fashion & style", "socializing", "dance",
-            "outdoor activities", "team sports", "individual sports", "fitness trends",
-            "street fashion", "makeup & beauty"
-        ]
-    },
-    {
-        "category": "Learning & Development",
-        "interests": [
-            "learning new skills", "travel & exploration", "mental wellbeing",
-            "social & environmental issues", "collecting", "cooking & baking",
-            "language learning", "coding & technology", "science experiments",
-            "history & culture"
-        ]
-    }
-]
-
-# Enhanced communication styles
-COMMUNICATION_STYLES = [
-    {
-        "style": "hesitant",
-        "traits": "very brief messages, takes time to open up, needs encouragement",
-        "example": "hi... not sure if i should say this",
-        "characteristics": ["shy", "uncertain", "needs reassurance", "careful with words"]
-    },
-    {
-        "style": "quiet",
-        "traits": "short, simple messages, may need prompting to share more",
-        "example": "i need help with something",
-        "characteristics": ["reserved", "thoughtful", "observant", "prefers listening"]
-    },
-    {
-        "style": "nervous",
-        "traits": "brief messages with uncertainty, may use ellipses",
-        "example": "um... can i talk about something?",
-        "characteristics": ["anxious", "worried", "seeks validation", "overthinks"]
-    },
-    {
-        "style": "shy",
-        "traits": "minimal responses, needs gentle encouragement",
-        "example": "yeah... it's hard to talk about",
-        "characteristics": ["introverted", "self-conscious", "needs time", "careful"]
-    },
-    {
-        "style": "uncertain",
-        "traits": "short messages with questions, unsure how to express themselves",
-        "example": "is this the right place to talk about... stuff?",
-        "characteristics": ["doubtful", "seeking guidance", "needs clarity", "cautious"]
-    },
-    {
-        "style": "direct",
-        "traits": "clear and straightforward, gets to the point",
-        "example": "I need help with bullying at school",
-        "characteristics": ["confident", "assertive", "practical", "solution-focused"]
-    },
-    {
-        "style": "emotional",
-        "traits": "expressive, shares feelings openly",
-        "example": "I'm really upset about what's happening",
-        "characteristics": ["sensitive", "expressive", "needs empathy", "open"]
-    },
-    {
-        "style": "formal",
-        "traits": "polite and structured, uses proper language",
-        "example": "I would like to discuss a personal matter",
-        "characteristics": ["respectful", "organized", "careful", "professional"]
-    }
-]
-
-# Enhanced gender identities
-GENDER_IDENTITIES = [
-    {"identity": "boy", "pronouns": "he/him", "characteristics": ["masculine", "male", "man"]},
-    {"identity": "girl", "pronouns": "she/her", "characteristics": ["feminine", "female", "woman"]},
-    {"identity": "non-binary person", "pronouns": "they/them", "characteristics": ["gender-neutral", "non-binary", "enby"]},
-    {"identity": "trans boy", "pronouns": "he/him", "characteristics": ["transmasculine", "trans male", "trans man"]},
-    {"identity": "trans girl", "pronouns": "she/her", "characteristics": ["transfeminine", "trans female", "trans woman"]},
-    {"identity": "genderfluid person", "pronouns": "they/them", "characteristics": ["fluid", "flexible", "changing"]},
-    {"identity": "agender person", "pronouns": "they/them", "characteristics": ["genderless", "neutral", "unaffiliated"]},
-    {"identity": "genderqueer person", "pronouns": "they/them", "characteristics": ["queer", "non-conforming", "unique"]}
-]
-
-# Enhanced education scenarios
-EDUCATION_SCENARIOS = [
-    {
-        "type": "secondary_school",
-        "details": "attending a local comprehensive school",
-        "challenges": ["exams", "homework", "school social life", "teachers"],
-        "characteristics": ["GCSE student", "teenager", "school-focused", "peer-oriented"]
-    },
-    {
-        "type": "sixth_form",
-        "details": "studying A-levels or equivalent",
-        "challenges": ["university applications", "increased workload", "future planning"],
-        "characteristics": ["post-16 student", "academic", "future-focused", "independent"]
-    },
-    {
-        "type": "college",
-        "details": "studying vocational courses",
-        "challenges": ["work placements", "practical skills", "career focus"],
-        "characteristics": ["vocational student", "hands-on", "career-oriented", "practical"]
-    },
-    {
-        "type": "apprenticeship",
-        "details": "combining work and study",
-        "challenges": ["work-life balance", "professional environment", "skill development"],
-        "characteristics": ["working student", "professional", "balanced", "developing"]
-    },
-    {
-        "type": "special_education",
-        "details": "attending a specialist school",
-        "challenges": ["learning support", "social integration", "individual needs"],
-        "characteristics": ["supported learning", "individualized", "inclusive", "focused"]
-    },
-    {
-        "type": "home_education",
-        "details": "learning at home",
-        "challenges": ["socialization", "structure", "resources"],
-        "characteristics": ["independent learner", "flexible", "self-directed", "family-oriented"]
-    }
-]
-
-def generate_persona():
-    age = random.randint(10, 25)
-    gender = random.choice(GENDER_IDENTITIES)
-    location = random.choice(LOCATIONS)
-    theme_category = random.choice(list(THEMES.keys()))
-    scenario = random.choice(THEMES[theme_category])
-    communication = random.choice(COMMUNICATION_STYLES)
-    education = random.choice(EDUCATION_SCENARIOS)
-    welsh_school = random.choice(WELSH_REFERENCES["schools"])
-    welsh_interest = random.choice(WELSH_REFERENCES["interests"])
-    welsh_family = random.choice(WELSH_REFERENCES["family"])
-    welsh_community = random.choice(WELSH_REFERENCES["communities"])
-    
-    # Select random interest category and interest
-    interest_category = random.choice(YOUTH_INTERESTS)
-    youth_interest = random.choice(interest_category["interests"])
-    
-    return {
-        "age": age,
-        "gender": gender,
-        "location": location,
-        "theme": theme_category,
-        "issue": scenario["issue"],
-        "outcome": scenario["outcome"],
-        "details": scenario["details"],
-        "communication": communication,
-        "education": education,
-        "welsh_school": welsh_school,
-        "welsh_interest": welsh_interest,
-        "welsh_family": welsh_family,
-        "welsh_community": welsh_community,
-        "youth_interest_category": interest_category["category"],
-        "youth_interest": youth_interest
-    }
+def llm_stream(operation, contents, **kwargs):
+    start = time.perf_counter()
+    first = True
+    try:
+        with span('llm_stream', operation=operation):
+            stream = llm.stream(contents, **kwargs)
+            for text in stream:
+                if first:
+                    metrics.TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - start, operation=operation)
+                    first = False
+                yield text
+    except Exception:
+        metrics.LLM_ERRORS.inc(operation=operation)
+        raise
+    metrics.record_usage(operation, stream.usage)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started_at = g.get('request_started')
+    if started_at is not None:
+        seconds = time.perf_counter() - started_at
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(seconds, endpoint=endpoint, status=response.status_code)
+        metrics.log_event('request', method=request.method, endpoint=endpoint,
+                          status=response.status_code, ms=round(seconds * 1000, 2))
+    return response
+
+@app.route('/healthz')
+def healthz():
+    # For load balancer health checks: no session, persona or model call
+    return Response('ok', mimetype='text/plain')
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# History policy for the persona chat. CHAT_HISTORY_TURNS keeps only the last
+# N advisor/young person exchanges in the prompt (0 keeps everything). With
+# CHAT_HISTORY_SUMMARY on, older exchanges are folded into a running summary
+# instead of being dropped, CHAT_SUMMARY_BATCH exchanges at a time. The
+# summary is written on the chat job queue, off the request.
+CHAT_HISTORY_TURNS = int(os.getenv('CHAT_HISTORY_TURNS', 0))
+CHAT_HISTORY_SUMMARY = env_flag('CHAT_HISTORY_SUMMARY')
+CHAT_SUMMARY_BATCH = int(os.getenv('CHAT_SUMMARY_BATCH', 4))
+
+# Themes, locations and the rest of the persona catalogue live in
+# data/persona_catalogue.json (PERSONA_CATALOGUE overrides the path). The
+# session only stores a persona reference: a short list of catalogue indices.
+persona_catalogue = load_catalogue()
+
+# Themes are drawn by theme_weights in the catalogue, skipping the last
+# PERSONA_RECENT_THEMES themes this trainee (session) has had, so a theme
+# doesn't come straight back. Half the themes by default: excluding nearly
+# all of them would leave one choice per draw, a fixed rotation in which the
+# weights no longer count. With PERSONA_SEED set, the nth persona of every
+# trainee is the same, for reproducible runs.
+PERSONA_RECENT_THEMES = int(os.getenv('PERSONA_RECENT_THEMES', len(persona_catalogue.themes) // 2))
+PERSONA_SEED = os.getenv('PERSONA_SEED')
+
+def generate_persona(theme=None, rng=random):
+    # Returns a persona reference; expand it with persona_catalogue.expand()
+    return persona_catalogue.sample(rng, theme=theme)
+
+def persona_cache_key():
+    # Identifies the persona system prompt for context caching
+    return ('persona', prompts.PERSONA_SYSTEM.version, tuple(session['persona']))
+
+def session_persona():
+    # Full persona dict for this session, or None if there isn't a valid one
+    ref = session.get('persona')
+    if not ref:
+        return None
+    try:
+        return persona_catalogue.expand(ref)
+    except StaleCatalogueError:
+        print("Session persona refers to an older persona catalogue")
+        return None
 
 def get_system_prompt(persona):
-    return f"""You are role-playing as a {persona['age']} year old {persona['gender']['identity']} from {persona['location']} 
-who is contacting the Meic Cymru helpline.
-
-Background:
-- {persona['education']['details']}
-- From a {persona['welsh_family']}
-- Attends a {persona['welsh_school']}
-- Interested in {persona['welsh_interest']} (Welsh culture)
-- Also interested in {persona['youth_interest']} ({persona['youth_interest_category']})
-
-Your situation:
-- You are experiencing: {persona['issue']}
-- Your desired outcome is: {persona['outcome']}
-- You should NOT immediately reveal your desired outcome
-- Let the advisor help you work through your feelings and find solutions
-
-As the young person:
-1. Use {persona['gender']['pronouns']} pronouns
-2. Keep messages short and natural (1-2 sentences max)
-3. Start by explaining your issue but don't share everything at once
-4. Use informal language appropriate for your age
-5. Use some Welsh words or phrases occasionally (but keep it natural)
-6. Reference your Welsh background and interests naturally
-7. Consider your education context when discussing issues
-8. If asked about your issue, share more details gradually
-9. If asked how you're feeling, describe your emotions honestly
-10. If asked about your background, mention your school, family, or interests
-11. If given advice, respond to it and share your thoughts
-12. If asked to elaborate, provide more details
-13. NEVER repeat the same phrase or response
-14. ALWAYS provide new information in each message
-15. If the advisor helps you reach your desired outcome, you can say goodbye
-16. Remember to be natural and human-like in your responses
-
-Remember you are a young person seeking help, not a counselor or advisor.
-Your responses should be brief and reflect the perspective and language of a young person in Wales.
-Start by explaining your issue and then respond naturally to the advisor's questions."""
+    return prompts.PERSONA_SYSTEM.render(**prompts.persona_fields(persona))
+
+@lru_cache(maxsize=1024)
+def system_prompt_for(ref):
+    # Rendered from the persona reference when needed rather than stored in
+    # the session; ref is a tuple so it can key the cache
+    return get_system_prompt(persona_catalogue.expand(list(ref)))
+
+# Personas are built ahead of time by a background thread. With
+# PERSONA_PREWARM on, each bundle also carries the young person's opening
+# message, generated against a standard advisor greeting, so the first reply
+# of a chat is ready before the trainee sends anything.
+PERSONA_POOL_SIZE = int(os.getenv('PERSONA_POOL_SIZE', 8))
+PERSONA_PREWARM = env_flag('PERSONA_PREWARM')
+OPENING_GREETING = "Hi, you're through to Meic. What would you like to talk about today?"
+# How closely (0-1) the trainee's first message must match OPENING_GREETING
+# for the pre-warmed reply to be used; otherwise it is answered as normal
+OPENING_MATCH = float(os.getenv('PERSONA_OPENING_MATCH', 0.6))
+
+def build_persona_bundle(theme=None, prewarm=False, rng=random):
+    persona = generate_persona(theme, rng)
+    system_prompt = system_prompt_for(tuple(persona))
+    bundle = {'persona': persona, 'opening': None}
+    if prewarm:
+        try:
+            response = llm_generate(
+                'opening', [{'role': 'user', 'parts': [OPENING_GREETING]}], system_instruction=system_prompt
+            )
+            bundle['opening'] = response.text or None
+        except Exception as e:
+            print(f"Error pre-warming opening message: {str(e)}")
+    return bundle
+
+# One bucket per theme; PERSONA_POOL_SIZE is shared between them
+persona_pool = PersonaPool(
+    make_bundle=lambda theme: build_persona_bundle(theme, prewarm=PERSONA_PREWARM),
+    make_fallback=build_persona_bundle,
+    size=max(PERSONA_POOL_SIZE // len(persona_catalogue.themes), 1),
+    keys=range(len(persona_catalogue.themes))
+)
+
+def next_persona_bundle():
+    recent = session.get('recent_themes', [])
+    drawn = session.get('personas_drawn', 0)
+    if PERSONA_SEED is not None:
+        # Built inline so the whole persona, not just the theme, is reproducible
+        rng = random.Random(f'{PERSONA_SEED}:{drawn}')
+        theme = persona_catalogue.sample_theme(rng, exclude=recent)
+        bundle = build_persona_bundle(theme, rng=rng)
+    else:
+        theme = persona_catalogue.sample_theme(exclude=recent)
+        bundle = persona_pool.take(theme)
+    session['recent_themes'] = (recent + [theme])[-PERSONA_RECENT_THEMES:] if PERSONA_RECENT_THEMES > 0 else []
+    session['personas_drawn'] = drawn + 1
+    return bundle
 
 @app.route('/')
 def home():
-    # Generate a new persona and reset conversation history
-    session['persona'] = generate_persona()
-    session['system_prompt'] = get_system_prompt(session['persona'])
+    # Take a ready persona from the pool and reset conversation history
+    bundle = next_persona_bundle()
+    start_conversation(bundle['persona'], bundle['opening'])
+    return render_template('index.html', conversation_id=session['conversation_id'])
+
+def start_conversation(persona, opening=None):
+    # The conversation ID is what /end-chat is called with; a page left open
+    # from an earlier chat can't end the new one by mistake
+    session['persona'] = persona
+    session['conversation_id'] = uuid.uuid4().hex
     session['conversation_history'] = []
-    return render_template('index.html')
+    session['opening'] = opening
+    session.pop('history_summary', None)
+    session.pop('summarised_messages', None)
+    session.pop('summary_job', None)
+    session.pop('turn_jobs', None)
+
+def load_chat_state():
+    # Get the persona and conversation history from session
+    conversation_history = session.get('conversation_history', [])
+
+    if session_persona() is None:
+        # If somehow the session was lost, generate a new persona
+        start_conversation(generate_persona())
+        conversation_history = []
+    apply_history_summary()
+    return system_prompt_for(tuple(session['persona'])), conversation_history
+
+def greeting_words(text):
+    return re.findall(r"[a-z']+", text.lower())
+
+def matches_greeting(message):
+    return SequenceMatcher(None, greeting_words(message), greeting_words(OPENING_GREETING)).ratio() >= OPENING_MATCH
+
+def take_opening(conversation_history, user_message):
+    # A pre-warmed opening message was written as the reply to
+    # OPENING_GREETING, so it only answers a first message much like it
+    if conversation_history:
+        return None
+    opening = session.pop('opening', None)
+    return opening if opening and matches_greeting(user_message) else None
+
+def build_chat_contents(conversation_history, user_message):
+    # The persona prompt is sent separately as a system instruction, so it is
+    # a stable prefix of every turn rather than part of a rebuilt transcript
+    # Messages already folded into the running summary are not sent again
+    summary = session.get('history_summary', '')
+    recent = conversation_history[session.get('summarised_messages', 0):]
+    if CHAT_HISTORY_TURNS and not CHAT_HISTORY_SUMMARY:
+        recent = recent[-2 * CHAT_HISTORY_TURNS:]
+
+    contents = []
+    for msg in recent:
+        role = 'user' if msg['role'] == 'user' else 'model'
+        contents.append({'role': role, 'parts': [msg['content']]})
+    contents.append({'role': 'user', 'parts': [user_message]})
+
+    if summary:
+        contents[0]['parts'].insert(0, f"(Summary of the conversation so far: {summary})")
+    return contents
+
+def summarise_history(summary, messages):
+    prompt = prompts.SUMMARY.render(
+        earlier_summary=f"Earlier summary: {summary}" if summary else "",
+        conversation=format_conversation(messages)
+    )
+    return llm_generate('summary', prompt).text.strip()
+
+def run_history_summary_job(payload):
+    return summarise_history(payload['summary'], payload['messages'])
+
+def apply_history_summary():
+    # A summary written by a chat worker is picked up at the start of the
+    # next turn; until then the messages are still sent verbatim
+    pending = session.get('summary_job')
+    if not pending:
+        return
+    try:
+        job = chat_jobs.get(pending['id'])
+    except Exception as e:
+        print(f"Error checking history summary: {str(e)}")
+        return
+    if job and job['status'] in ('queued', 'running'):
+        return
+    session.pop('summary_job')
+    if job and job['status'] == 'done':
+        session['history_summary'] = job['result']
+        session['summarised_messages'] = pending['cutoff']
+    else:
+        # Not fatal: the messages stay verbatim and are queued again next turn
+        print(f"Error summarising history: {job['error'] if job else 'job expired'}")
+
+def queue_history_summary(conversation_history):
+    # Only one summary job per conversation at a time, so batches fold in order
+    if not (CHAT_HISTORY_SUMMARY and CHAT_HISTORY_TURNS) or session.get('summary_job'):
+        return
+    summarised = session.get('summarised_messages', 0)
+    keep = 2 * CHAT_HISTORY_TURNS
+    if len(conversation_history) - summarised < keep + 2 * CHAT_SUMMARY_BATCH:
+        return
+    cutoff = len(conversation_history) - keep
+    try:
+        job_id = chat_jobs.submit({
+            'kind': 'history_summary',
+            'summary': session.get('history_summary', ''),
+            'messages': conversation_history[summarised:cutoff]
+        })
+    except Exception as e:
+        print(f"Error queueing history summary: {str(e)}")
+        return
+    session['summary_job'] = {'id': job_id, 'cutoff': cutoff}
+
+def record_exchange(conversation_history, user_message, reply):
+    # Update conversation history
+    conversation_history.append({"role": "user", "content": user_message})
+    conversation_history.append({"role": "assistant", "content": reply})
+    session['conversation_history'] = conversation_history
+    queue_turn_note(conversation_history)
+    queue_history_summary(conversation_history)
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -510,118 +359,301 @@ def chat():
         user_message = request.json.get('message', '')
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
-            
-        # Get the system prompt and conversation history from session
-        system_prompt = session.get('system_prompt', '')
-        conversation_history = session.get('conversation_history', [])
-        
-        if not system_prompt:
-            # If somehow the session was lost, generate a new persona
-            session['persona'] = generate_persona()
-            session['system_prompt'] = get_system_prompt(session['persona'])
-            system_prompt = session['system_prompt']
-            conversation_history = []
-        
-        # Format the conversation history
-        history_text = ""
-        for msg in conversation_history:
-            role = "Advisor" if msg['role'] == 'user' else "Young Person"
-            history_text += f"{role}: {msg['content']}\n"
-        
-        # Combine system prompt, conversation history, and new message
-        full_prompt = f"""{system_prompt}
 
-Previous conversation:
-{history_text}
+        with span('chat_prompt_build'):
+            system_prompt, conversation_history = load_chat_state()
+            opening = take_opening(conversation_history, user_message)
+            contents = build_chat_contents(conversation_history, user_message)
 
-Advisor: {user_message}
-Young Person: """
-        
-        response = model.generate_content(full_prompt)
+        if opening:
+            record_exchange(conversation_history, user_message, opening)
+            return jsonify({'response': opening})
+
+        response = llm_generate('chat', contents, system_instruction=system_prompt, cache_key=persona_cache_key())
         
         if not response.text:
             return jsonify({'error': 'Empty response from Gemini API'}), 500
             
-        # Update conversation history
-        conversation_history.append({"role": "user", "content": user_message})
-        conversation_history.append({"role": "assistant", "content": response.text})
-        session['conversation_history'] = conversation_history
+        record_exchange(conversation_history, user_message, response.text)
         
         return jsonify({'response': response.text})
+    except LLMUnavailableError as e:
+        # Failing fast while Gemini is degraded; the trainee can resend shortly
+        print(f"Error: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         print(f"Error: {str(e)}")
         return jsonify({'error': f'API Error: {str(e)}'}), 500
 
-def analyze_conversation(conversation, persona):
-    # Create a prompt for the AI to analyze the conversation
-    analysis_prompt = f"""Analyze this conversation between a Meic Cymru helpline advisor and a {persona['age']} year old {persona['gender']['identity']} from {persona['location']} 
-who is contacting about an issue related to {persona['theme']}.
-
-First, provide a brief summary of the conversation in 2-3 sentences.
-
-Then, provide information about the young person in this format:
-ABOUT_YOUNG_PERSON: [Include age, gender, location, education, Welsh background, and the specific issue they were dealing with]
-
-Then evaluate the advisor's performance in these areas:
-
-1. Tone of Voice (0-100):
-- Was the advisor friendly and approachable?
-- Did they maintain a professional yet empathetic tone?
-- Were they patient and understanding?
-
-2. Engagement (0-100):
-- Did the advisor actively listen to the young person?
-- Did they ask appropriate follow-up questions?
-- Did they allow the young person to express themselves fully?
-- Did they show genuine interest in the young person's situation?
-
-3. Resolution (0-100):
-- Was the issue addressed effectively?
-- Were appropriate solutions or next steps suggested?
-- Was the conversation productive and focused?
-- How quickly was the core issue identified and addressed?
-
-4. Information Provided (0-100):
-- Were relevant services or resources recommended?
-- Was the information appropriate for the young person's location and situation?
-- Were alternative options considered?
-- Was the information clear and understandable?
-
-For each category, provide:
-1. A score (0-100)
-2. Specific feedback on what was done well and what could be improved
-3. Examples from the conversation to support your evaluation
-
-Conversation:
-{format_conversation(conversation)}
-
-Provide your analysis in this exact format:
-CONVERSATION_SUMMARY: [2-3 sentence summary]
-
-ABOUT_YOUNG_PERSON: [Details about the young person]
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/chat-stream', methods=['POST'])
+def chat_stream():
+    # Same as /chat, but the reply is pushed to the browser as Server-Sent
+    # Events while Gemini is still generating it
+    user_message = request.json.get('message', '')
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    with span('chat_prompt_build'):
+        system_prompt, conversation_history = load_chat_state()
+        opening = take_opening(conversation_history, user_message)
+        contents = build_chat_contents(conversation_history, user_message)
+        cache_key = persona_cache_key()
+
+    def stream_reply():
+        if opening:
+            yield opening
+            return
+        yield from llm_stream('chat', contents, system_instruction=system_prompt, cache_key=cache_key)
+
+    def generate():
+        chunks = []
+        try:
+            for text in stream_reply():
+                chunks.append(text)
+                yield sse_event({'text': text})
+
+            reply = "".join(chunks)
+            if not reply:
+                yield sse_event({'error': 'Empty response from Gemini API'}, event='error')
+                return
+
+            # Write the full reply to history once the stream has finished
+            record_exchange(conversation_history, user_message, reply)
+            app.session_interface.persist(session)
+
+            yield sse_event({'response': reply}, event='done')
+        except LLMUnavailableError as e:
+            print(f"Error: {str(e)}")
+            yield sse_event({'error': str(e)}, event='error')
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            yield sse_event({'error': f'API Error: {str(e)}'}, event='error')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Parsed analyses are cached by a hash of the transcript, persona and the
+# analysis template's version, so re-scoring the same conversation costs no
+# Gemini call and editing the prompt invalidates exactly its results. Bump
+# ANALYSIS_PARSER_VERSION when the parsers change.
+ANALYSIS_PARSER_VERSION = '2'
+# ANALYSIS_OUTPUT=json asks Gemini for a response matching ANALYSIS_SCHEMA;
+# text uses the original line format and parse_analysis()
+ANALYSIS_OUTPUT = os.getenv('ANALYSIS_OUTPUT', 'json')
+
+def analysis_rubric():
+    return prompts.ANALYSIS_RUBRIC_JSON if ANALYSIS_OUTPUT == 'json' else prompts.ANALYSIS_RUBRIC_TEXT
+
+# ANALYSIS_FANOUT=on splits the analysis into concurrent, smaller requests:
+# one per scored dimension and one for the summary, each with its own rubric.
+# overall is computed locally, and a part that fails is retried on its own.
+# Fanned-out parts always use JSON output.
+ANALYSIS_FANOUT = env_flag('ANALYSIS_FANOUT')
+ANALYSIS_FANOUT_RETRIES = int(os.getenv('ANALYSIS_FANOUT_RETRIES', 1))
+FANOUT_RUBRICS = {'summary': prompts.SUMMARY_RUBRIC, **prompts.DIMENSION_RUBRICS}
+fanout_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ANALYSIS_FANOUT_THREADS', 16)), thread_name_prefix='analysis-fanout'
+)
+
+def analysis_rubric_version():
+    if ANALYSIS_FANOUT:
+        return content_key(*(rubric.version for rubric in FANOUT_RUBRICS.values()))[:12]
+    return analysis_rubric().version
+
+def analysis_prompt_version(request_template=prompts.ANALYSIS_REQUEST):
+    return f'{analysis_rubric_version()}.{request_template.version}'
+
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', 7 * 24 * 60 * 60))
+ANALYSIS_CACHE_DIR = os.getenv('ANALYSIS_CACHE_DIR', os.path.join('cache', 'analysis'))
+analysis_cache = TieredCache(
+    LRUCache(maxsize=int(os.getenv('ANALYSIS_CACHE_SIZE', 256)), ttl=ANALYSIS_CACHE_TTL),
+    DiskCache(ANALYSIS_CACHE_DIR, ttl=ANALYSIS_CACHE_TTL) if ANALYSIS_CACHE_DIR else None
+)
+
+# Finished analyses by analysis ID, with the transcript they were made from,
+# so /save-chat can build the report without the browser sending either back.
+# The disk tier lets any worker serve the download.
+ANALYSIS_RESULT_TTL = int(os.getenv('ANALYSIS_RESULT_TTL', 24 * 60 * 60))
+ANALYSIS_RESULT_DIR = os.getenv('ANALYSIS_RESULT_DIR', os.path.join('cache', 'results'))
+analysis_results = TieredCache(
+    LRUCache(maxsize=int(os.getenv('ANALYSIS_CACHE_SIZE', 256)), ttl=ANALYSIS_RESULT_TTL),
+    DiskCache(ANALYSIS_RESULT_DIR, ttl=ANALYSIS_RESULT_TTL) if ANALYSIS_RESULT_DIR else None
+)
+
+def valid_analysis_id(analysis_id):
+    # The uuid4().hex form /end-chat issues; anything else is never looked up
+    return isinstance(analysis_id, str) and re.fullmatch(r'[0-9a-f]{32}', analysis_id) is not None
+
+def store_analysis(analysis_id, conversation, feedback):
+    analysis_results.set(analysis_id, {'conversation': conversation, 'feedback': feedback})
+    return dict(feedback, analysis_id=analysis_id)
+
+# Role labels vary with how the transcript was collected: the chat records
+# user/assistant, older reports and exports use Advisor/Young Person
+CONVERSATION_ROLES = {
+    'user': 'user', 'advisor': 'user',
+    'assistant': 'assistant', 'model': 'assistant', 'young person': 'assistant'
+}
 
-TONE_SCORE: [number]
-TONE_FEEDBACK: [feedback]
+def canonical_conversation(conversation):
+    """The transcript with every role as user (advisor) or assistant (young person)."""
+    messages = []
+    for msg in conversation:
+        role = CONVERSATION_ROLES.get(str(msg['role']).strip().lower())
+        if role is None:
+            raise ValueError(f"Unknown conversation role: {msg['role']!r}")
+        messages.append({'role': role, 'content': msg['content']})
+    return messages
 
-ENGAGEMENT_SCORE: [number]
-ENGAGEMENT_FEEDBACK: [feedback]
+def normalize_conversation(conversation):
+    # Whitespace varies too; roles are already canonical
+    return [[msg['role'], ' '.join(msg['content'].split())] for msg in conversation]
 
-RESOLUTION_SCORE: [number]
-RESOLUTION_FEEDBACK: [feedback]
+def analysis_cache_key(conversation, persona):
+    return content_key(
+        analysis_prompt_version(), ANALYSIS_PARSER_VERSION, normalize_conversation(conversation), persona
+    )
 
-INFORMATION_SCORE: [number]
-INFORMATION_FEEDBACK: [feedback]
+def analyze_conversation(conversation, persona):
+    # Roles are normalised once, so the prompt and the cache key agree
+    conversation = canonical_conversation(conversation)
+    key = analysis_cache_key(conversation, persona)
+    return shared_analysis(key, lambda: generate_analysis(conversation, persona), analysis_prompt_version())
+
+def shared_analysis(key, generate, prompt_version):
+    # A second "End chat" for the same transcript waits for the first
+    # analysis rather than starting its own. Callers add fields to the
+    # result, so they never get the shared or cached object itself.
+    feedback = flights.do(key, lambda: cached_analysis(key, generate, prompt_version), label='analysis')
+    return copy.deepcopy(feedback)
+
+def cached_analysis(key, generate, prompt_version):
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return cached
+
+    feedback = generate()
+    if feedback is not None:
+        # Recorded so stored and batch results say which prompt produced them
+        feedback['prompt_version'] = prompt_version
+        # Stored as a copy, so nothing done to the returned dict reaches the cache
+        analysis_cache.set(key, copy.deepcopy(feedback))
+    return feedback
+
+def generate_analysis(conversation, persona):
+    # Create a prompt for the AI to analyze the conversation
+    analysis_prompt = prompts.ANALYSIS_REQUEST.render(
+        conversation=format_conversation(conversation), **prompts.persona_fields(persona)
+    )
+    return run_analysis_prompt(analysis_prompt)
+
+def run_analysis_prompt(analysis_prompt):
+    if ANALYSIS_FANOUT:
+        return run_analysis_fanout(analysis_prompt)
+    # The rubric is the same for every conversation, so it goes in the
+    # (context-cached) system instruction
+    rubric = analysis_rubric()
+    try:
+        if ANALYSIS_OUTPUT == 'json':
+            response = llm_generate(
+                'analysis', analysis_prompt,
+                system_instruction=rubric.render(), cache_key=('analysis', rubric.version),
+                generation_config={
+                    'response_mime_type': 'application/json',
+                    'response_schema': ANALYSIS_SCHEMA
+                }
+            )
+            with span('parse_analysis', output='json'):
+                feedback, invalid = parse_structured_analysis(response.text)
+            if invalid:
+                # Ask again in the line format for the fields the JSON got wrong
+                print(f"Structured analysis invalid for {', '.join(invalid)}, re-requesting as text")
+                feedback = fill_from_text_analysis(analysis_prompt, feedback, invalid)
+            return feedback
+        return run_text_analysis(analysis_prompt)
+    except Exception as e:
+        print(f"Error analyzing conversation: {str(e)}")
+        return None
 
-OVERALL_SCORE: [number]
-OVERALL_FEEDBACK: [feedback]"""
+def run_text_analysis(analysis_prompt):
+    # None when no field could be parsed, so the result isn't cached
+    feedback, found = request_text_analysis(analysis_prompt)
+    return feedback if found else None
+
+def request_text_analysis(analysis_prompt):
+    rubric = prompts.ANALYSIS_RUBRIC_TEXT
+    response = llm_generate(
+        'analysis', analysis_prompt,
+        system_instruction=rubric.render(), cache_key=('analysis', rubric.version)
+    )
+    with span('parse_analysis', output='text'):
+        return parse_analysis(response.text)
 
+def fill_from_text_analysis(analysis_prompt, feedback, invalid):
     try:
-        response = model.generate_content(analysis_prompt)
-        return parse_analysis(response.text)
+        text_feedback, found = request_text_analysis(analysis_prompt)
     except Exception as e:
-        print(f"Error analyzing conversation: {str(e)}")
+        print(f"Error re-requesting analysis as text: {str(e)}")
+        return feedback
+    if feedback is None:
+        return text_feedback if found else None
+    for key in invalid:
+        if key in found:
+            feedback[key] = text_feedback[key]
+    return feedback
+
+def analyze_part(part, analysis_prompt):
+    rubric = FANOUT_RUBRICS[part]
+    response = llm_generate(
+        f'analysis_{part}', analysis_prompt,
+        system_instruction=rubric.render(), cache_key=('analysis', part, rubric.version),
+        generation_config={
+            'response_mime_type': 'application/json',
+            'response_schema': SUMMARY_SCHEMA if part == 'summary' else SCORED_SCHEMA
+        }
+    )
+    data = json.loads(response.text)
+    if part == 'summary':
+        if not isinstance(data, dict) or 'conversation_summary' not in data:
+            raise ValueError('Summary response is missing conversation_summary')
+        return data
+    return ScoredFeedback.from_dict(data)
+
+def run_analysis_fanout(analysis_prompt):
+    results = {}
+    pending = list(FANOUT_RUBRICS)
+    for attempt in range(1 + ANALYSIS_FANOUT_RETRIES):
+        with span('analysis_fanout', attempt=attempt):
+            futures = {part: fanout_executor.submit(analyze_part, part, analysis_prompt) for part in pending}
+            pending = []
+            for part, future in futures.items():
+                try:
+                    results[part] = future.result()
+                except Exception as e:
+                    print(f"Error analyzing {part} (attempt {attempt + 1}): {str(e)}")
+                    pending.append(part)
+        if not pending:
+            break
+    if pending:
+        print(f"Error analyzing conversation: {', '.join(pending)} failed after retries")
         return None
 
+    dimensions = {category: results[category] for category in TURN_CATEGORIES}
+    labels = {key: label for key, (label, _) in prompts.DIMENSIONS.items()}
+    return AnalysisResult(
+        conversation_summary=str(results['summary'].get('conversation_summary', '')).strip(),
+        about_young_person=str(results['summary'].get('about_young_person', '')).strip(),
+        overall=overall_from_dimensions(dimensions, labels),
+        **dimensions
+    ).to_dict()
+
 def format_conversation(conversation):
     formatted = ""
     for msg in conversation:
@@ -629,246 +661,325 @@ def format_conversation(conversation):
         formatted += f"{role}: {msg['content']}\n\n"
     return formatted
 
+def parse_structured_analysis(analysis_text):
+    # Returns the feedback and the fields that didn't validate (left at their
+    # defaults); the feedback is None when none of it is usable
+    try:
+        result, invalid = AnalysisResult.from_json(analysis_text)
+    except ValueError as e:
+        print(f"Structured analysis unreadable: {str(e)}")
+        return None, list(SUMMARY_FIELDS + CATEGORIES)
+    if len(invalid) == len(SUMMARY_FIELDS + CATEGORIES):
+        return None, invalid
+    return result.to_dict(), invalid
+
+ANALYSIS_FIELDS = {
+    'CONVERSATION_SUMMARY': ('conversation_summary', None),
+    'ABOUT_YOUNG_PERSON': ('about_young_person', None),
+    'TONE_SCORE': ('tone', 'score'),
+    'TONE_FEEDBACK': ('tone', 'feedback'),
+    'ENGAGEMENT_SCORE': ('engagement', 'score'),
+    'ENGAGEMENT_FEEDBACK': ('engagement', 'feedback'),
+    'RESOLUTION_SCORE': ('resolution', 'score'),
+    'RESOLUTION_FEEDBACK': ('resolution', 'feedback'),
+    'INFORMATION_SCORE': ('information', 'score'),
+    'INFORMATION_FEEDBACK': ('information', 'feedback'),
+    'OVERALL_SCORE': ('overall', 'score'),
+    'OVERALL_FEEDBACK': ('overall', 'feedback'),
+}
+
 def parse_analysis(analysis_text):
-    scores = {
-        'conversation_summary': '',
-        'about_young_person': '',
-        'tone': {'score': 0, 'feedback': ''},
-        'engagement': {'score': 0, 'feedback': ''},
-        'resolution': {'score': 0, 'feedback': ''},
-        'information': {'score': 0, 'feedback': ''},
-        'overall': {'score': 0, 'feedback': ''}
-    }
-    
+    # Returns the feedback and the set of fields found in the text
+    scores = AnalysisResult().to_dict()
+    found = set()
+
     current_section = None
     for line in analysis_text.split('\n'):
         line = line.strip()
-        if line.startswith('CONVERSATION_SUMMARY:'):
-            scores['conversation_summary'] = line.split(':', 1)[1].strip()
-        elif line.startswith('ABOUT_YOUNG_PERSON:'):
-            scores['about_young_person'] = line.split(':', 1)[1].strip()
-        elif line.startswith('TONE_SCORE:'):
-            scores['tone']['score'] = int(line.split(':')[1].strip())
-        elif line.startswith('TONE_FEEDBACK:'):
-            scores['tone']['feedback'] = line.split(':', 1)[1].strip()
-        elif line.startswith('ENGAGEMENT_SCORE:'):
-            scores['engagement']['score'] = int(line.split(':')[1].strip())
-        elif line.startswith('ENGAGEMENT_FEEDBACK:'):
-            scores['engagement']['feedback'] = line.split(':', 1)[1].strip()
-        elif line.startswith('RESOLUTION_SCORE:'):
-            scores['resolution']['score'] = int(line.split(':')[1].strip())
-        elif line.startswith('RESOLUTION_FEEDBACK:'):
-            scores['resolution']['feedback'] = line.split(':', 1)[1].strip()
-        elif line.startswith('INFORMATION_SCORE:'):
-            scores['information']['score'] = int(line.split(':')[1].strip())
-        elif line.startswith('INFORMATION_FEEDBACK:'):
-            scores['information']['feedback'] = line.split(':', 1)[1].strip()
-        elif line.startswith('OVERALL_SCORE:'):
-            scores['overall']['score'] = int(line.split(':')[1].strip())
-        elif line.startswith('OVERALL_FEEDBACK:'):
-            scores['overall']['feedback'] = line.split(':', 1)[1].strip()
-    
-    return scores
+        label, _, value = line.partition(':')
+        if label in ANALYSIS_FIELDS:
+            current_section = ANALYSIS_FIELDS[label]
+            key, field = current_section
+            value = value.strip()
+            if field is None:
+                scores[key] = value
+                if value:
+                    found.add(key)
+            elif field == 'score':
+                try:
+                    scores[key]['score'] = parse_score(value)
+                    found.add(key)
+                except ValueError:
+                    print(f"Could not parse {label}: {value!r}")
+                current_section = None
+            else:
+                scores[key][field] = value
+        elif line and current_section:
+            # Continuation of a multi-line summary or feedback section
+            key, field = current_section
+            if field is None:
+                scores[key] = (scores[key] + '\n' + line).strip()
+                found.add(key)
+            else:
+                scores[key][field] += '\n' + line
+
+    return scores, found
+
+# ANALYSIS_MODE=rolling notes and scores each exchange in the background
+# while the chat goes on, so /end-chat only has to synthesise those notes
+# rather than read the whole transcript. full analyses the transcript at the end.
+ANALYSIS_MODE = os.getenv('ANALYSIS_MODE', 'full')
+
+def queue_turn_note(conversation_history):
+    # Job IDs are kept in the session, one per exchange, in order
+    if ANALYSIS_MODE != 'rolling':
+        return
+    job_id = None
+    try:
+        job_id = chat_jobs.submit({
+            'kind': 'turn_note',
+            'persona': session['persona'],
+            'turn': len(conversation_history) // 2,
+            'exchange': conversation_history[-2:],
+            'previous': conversation_history[-4:-2]
+        })
+    except Exception as e:
+        # Not fatal: the synthesis reads this exchange in full instead
+        print(f"Error queueing turn note: {str(e)}")
+    session['turn_jobs'] = session.get('turn_jobs', []) + [job_id]
+
+def run_turn_note_job(payload):
+    persona = persona_catalogue.expand(payload['persona'])
+    previous = payload.get('previous')
+    prompt = prompts.TURN_NOTE_REQUEST.render(
+        turn=payload['turn'],
+        exchange=format_conversation(payload['exchange']),
+        previous_exchange=f"Previous exchange, for context:\n{format_conversation(previous)}" if previous else "",
+        **prompts.persona_fields(persona)
+    )
+    response = llm_generate(
+        'turn_note', prompt,
+        system_instruction=prompts.TURN_NOTE_RUBRIC.render(),
+        cache_key=('turn_note', prompts.TURN_NOTE_RUBRIC.version),
+        generation_config={'response_mime_type': 'application/json', 'response_schema': TURN_NOTE_SCHEMA}
+    )
+    return TurnNote.from_json(response.text).to_dict()
+
+def format_turn_note(turn, note):
+    lines = [f"Exchange {turn}: {note['summary']}"]
+    for category, label in zip(TURN_CATEGORIES, ('Tone', 'Engagement', 'Resolution', 'Information')):
+        lines.append(f"  {label} {note[category]['score']}: {note[category]['feedback']}")
+    return '\n'.join(lines)
+
+def analyze_from_notes(conversation, persona, turn_jobs):
+    # Exchanges whose note is missing, failed or still running are given in full
+    sections = []
+    for i in range(0, len(conversation), 2):
+        turn = i // 2 + 1
+        job_id = turn_jobs[turn - 1] if turn - 1 < len(turn_jobs) else None
+        job = chat_jobs.get(job_id) if job_id else None
+        if job and job['status'] == 'done':
+            sections.append(format_turn_note(turn, job['result']))
+        else:
+            sections.append(f"Exchange {turn} (no notes):\n{format_conversation(conversation[i:i + 2])}")
+    analysis_prompt = prompts.ANALYSIS_NOTES_REQUEST.render(
+        notes='\n\n'.join(sections), **prompts.persona_fields(persona)
+    )
+    # Cached and coalesced like a full analysis. The notes are part of the
+    # prompt, so an /end-chat made before every note was ready keys differently
+    prompt_version = analysis_prompt_version(prompts.ANALYSIS_NOTES_REQUEST)
+    key = content_key('notes', prompt_version, ANALYSIS_PARSER_VERSION, analysis_prompt)
+    return shared_analysis(key, lambda: run_analysis_prompt(analysis_prompt), prompt_version)
+
+def end_of_chat_analysis(conversation, persona, turn_jobs=None):
+    if turn_jobs:
+        return analyze_from_notes(conversation, persona, turn_jobs)
+    return analyze_conversation(conversation, persona)
+
+def run_analysis_job(payload):
+    # Jobs carry the persona reference rather than the full dict
+    persona = persona_catalogue.expand(payload['persona'])
+    feedback = end_of_chat_analysis(payload['conversation'], persona, payload.get('turn_jobs'))
+    if not feedback:
+        raise RuntimeError('Failed to analyze conversation')
+    feedback['persona'] = persona
+    if payload.get('analysis_id'):
+        return store_analysis(payload['analysis_id'], payload['conversation'], feedback)
+    return feedback
+
+JOB_HANDLERS = {
+    'analysis': run_analysis_job, 'turn_note': run_turn_note_job, 'history_summary': run_history_summary_job
+}
+
+def run_job(payload):
+    return JOB_HANDLERS[payload.get('kind', 'analysis')](payload)
+
+# With {"async": true}, /end-chat queues the analysis and returns a job ID
+# straight away; results come from /jobs/<id> or its event stream.
+analysis_jobs = create_job_queue()
+analysis_workers = JobWorkerPool(
+    analysis_jobs, run_job, workers=int(os.getenv('ANALYSIS_WORKERS', 4)), name='analysis-worker'
+)
+# Work done alongside the chat (the per-exchange notes of rolling
+# evaluation and the running history summary) has its own queue and threads, so a cohort's notes never hold
+# up an end-of-chat analysis
+chat_jobs = create_job_queue(name='chat_jobs')
+chat_workers = JobWorkerPool(
+    chat_jobs, run_job, workers=int(os.getenv('CHAT_JOB_WORKERS', 4)), name='chat-worker'
+)
 
 @app.route('/end-chat', methods=['POST'])
 def end_chat():
     try:
-        conversation = request.json.get('conversation', [])
+        # The transcript is the one recorded on the server as the chat went on
+        conversation_id = request.json.get('conversation_id')
+        if not conversation_id or conversation_id != session.get('conversation_id'):
+            return jsonify({'error': 'Conversation not found'}), 404
+        conversation = session.get('conversation_history', [])
         if not conversation:
-            return jsonify({'error': 'No conversation provided'}), 400
+            return jsonify({'error': 'No conversation to analyse'}), 400
             
-        persona = session.get('persona')
+        persona = session_persona()
         if not persona:
             return jsonify({'error': 'No persona found'}), 400
+
+        turn_jobs = session.get('turn_jobs') if ANALYSIS_MODE == 'rolling' else None
+        analysis_id = uuid.uuid4().hex
+
+        if request.json.get('async'):
+            job_id = analysis_jobs.submit({
+                'kind': 'analysis', 'conversation': conversation, 'persona': session['persona'],
+                'turn_jobs': turn_jobs, 'analysis_id': analysis_id
+            })
+            return jsonify({
+                'job_id': job_id, 'analysis_id': analysis_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'
+            }), 202
             
-        feedback = analyze_conversation(conversation, persona)
+        feedback = end_of_chat_analysis(conversation, persona, turn_jobs)
         if not feedback:
             return jsonify({'error': 'Failed to analyze conversation'}), 500
             
         # Add persona information to the response
         feedback['persona'] = persona
             
-        return jsonify(feedback)
+        return jsonify(store_analysis(analysis_id, conversation, feedback))
     except Exception as e:
         print(f"Error in end-chat: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def create_pdf(conversation, feedback):
-    try:
-        buffer = BytesIO()
-        # Add margins to the document
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=letter,
-            leftMargin=50,
-            rightMargin=50,
-            topMargin=50,
-            bottomMargin=50
-        )
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Get current date and time
-        current_datetime = datetime.now().strftime("%d %B %Y, %H:%M")
-        
-        # Define custom colors
-        meic_purple = colors.Color(151/255, 65/255, 146/255)
-        meic_lavender = colors.Color(225/255, 164/255, 228/255)
-        
-        # Add title with date and time
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            textColor=meic_purple,
-            spaceAfter=10
-        )
-        subtitle_style = ParagraphStyle(
-            'CustomSubtitle',
-            parent=styles['Normal'],
-            fontSize=12,
-            textColor=colors.grey,
-            spaceAfter=30
-        )
-        
-        # Add section heading style
-        section_style = ParagraphStyle(
-            'SectionHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            textColor=meic_purple,
-            spaceAfter=12
-        )
-        
-        story.append(Paragraph("Chat Conversation and Feedback", title_style))
-        story.append(Paragraph(f"Generated on: {current_datetime}", subtitle_style))
-        
-        # Add conversation summary
-        story.append(Paragraph("Conversation Summary:", section_style))
-        story.append(Paragraph(feedback.get('conversation_summary', ''), styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Add persona details
-        story.append(Paragraph("About Young Person:", section_style))
-        persona = feedback.get('persona', {})
-        if persona:
-            persona_details = [
-                f"Age: {persona.get('age', '')}",
-                f"Gender: {persona.get('gender', {}).get('identity', '')}",
-                f"Location: {persona.get('location', '')}",
-                f"Education: {persona.get('education', {}).get('details', '')}",
-                f"Welsh Background: {persona.get('welsh_family', '')}, attends a {persona.get('welsh_school', '')}, interested in {persona.get('welsh_interest', '')}",
-                f"Issue: {persona.get('issue', '')}",
-                f"Desired Outcome: {persona.get('outcome', '')}"
-            ]
-            for detail in persona_details:
-                story.append(Paragraph(detail, styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Add conversation
-        story.append(Paragraph("Conversation:", section_style))
-        story.append(Spacer(1, 12))
-        
-        # Create conversation table with wrapped text
-        conv_data = [['Role', 'Message']]
-        for msg in conversation:
-            # Convert message content to Paragraph for word wrapping
-            wrapped_content = Paragraph(msg['content'], styles['Normal'])
-            conv_data.append([msg['role'], wrapped_content])
-        
-        conv_table = Table(conv_data, colWidths=[1.5*inch, 4.5*inch])
-        conv_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), meic_lavender),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6)
-        ]))
-        story.append(conv_table)
-        story.append(Spacer(1, 20))
-        
-        # Add feedback
-        story.append(Paragraph("Feedback:", section_style))
-        story.append(Spacer(1, 12))
-        
-        # Create feedback table with wrapped text
-        feedback_data = [
-            ['Category', 'Score', 'Feedback'],
-            ['Tone of Voice', feedback['tone']['score'], Paragraph(feedback['tone']['feedback'], styles['Normal'])],
-            ['Engagement', feedback['engagement']['score'], Paragraph(feedback['engagement']['feedback'], styles['Normal'])],
-            ['Resolution', feedback['resolution']['score'], Paragraph(feedback['resolution']['feedback'], styles['Normal'])],
-            ['Information Provided', feedback['information']['score'], Paragraph(feedback['information']['feedback'], styles['Normal'])],
-            ['Overall', feedback['overall']['score'], Paragraph(feedback['overall']['feedback'], styles['Normal'])]
-        ]
-        
-        feedback_table = Table(feedback_data, colWidths=[2*inch, 1*inch, 3*inch])
-        feedback_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), meic_lavender),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6)
-        ]))
-        story.append(feedback_table)
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
-    except Exception as e:
-        print(f"Error in create_pdf: {str(e)}")
-        raise
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    # Server-Sent Events alternative to polling /jobs/<id>
+    if analysis_jobs.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        last_status = None
+        while True:
+            job = analysis_jobs.get(job_id)
+            if job is None:
+                yield sse_event({'error': 'Job not found'}, event='error')
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield sse_event(job, event=job['status'])
+            if job['status'] in ('done', 'failed'):
+                return
+            time.sleep(0.5)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Rendered PDFs are cached by a hash of their content. The hash doubles as the
+# ETag, so a repeat download with If-None-Match gets a 304 without ReportLab
+# running again. PDF_SPOOL_DIR adds an on-disk tier shared by workers.
+PDF_CACHE_TTL = int(os.getenv('PDF_CACHE_TTL', 24 * 60 * 60))
+PDF_SPOOL_DIR = os.getenv('PDF_SPOOL_DIR', '')
+pdf_cache = TieredCache(
+    LRUCache(maxsize=int(os.getenv('PDF_CACHE_SIZE', 64)), ttl=PDF_CACHE_TTL),
+    DiskCache(PDF_SPOOL_DIR, ttl=PDF_CACHE_TTL, binary=True) if PDF_SPOOL_DIR else None
+)
+# Cache misses are rendered in a bounded pool of processes (PDF_* settings)
+pdf_renderer = PDFRenderer.from_env()
+
+def report_conversation(conversation):
+    roles = {'user': 'Advisor', 'assistant': 'Young Person'}
+    return [{'role': roles.get(msg['role'], msg['role']), 'content': msg['content']} for msg in conversation]
+
+def render_pdf(conversation, feedback):
+    key = content_key('pdf', conversation, feedback)
+    pdf_bytes = pdf_cache.get(key)
+    if pdf_bytes is None:
+        with span('pdf_render'):
+            pdf_bytes = pdf_renderer.render(conversation, feedback)
+        pdf_cache.set(key, pdf_bytes)
+    return key, pdf_bytes
 
 @app.route('/save-chat', methods=['POST'])
 def save_chat():
     try:
-        data = request.json
-        conversation = data.get('conversation', [])
-        feedback = data.get('feedback', {})
-        
-        if not conversation or not feedback:
-            return jsonify({'error': 'No conversation or feedback provided'}), 400
+        # The report is built from the analysis as stored by /end-chat
+        analysis_id = request.json.get('analysis_id')
+        record = analysis_results.get(analysis_id) if valid_analysis_id(analysis_id) else None
+        if record is None:
+            return jsonify({'error': 'Analysis not found'}), 404
+        conversation = report_conversation(record['conversation'])
+        feedback = record['feedback']
             
-        # Create PDF
-        pdf_buffer = create_pdf(conversation, feedback)
-        
+        # The client already has this exact PDF
+        etag = content_key('pdf', conversation, feedback)
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        # Create PDF, or reuse one rendered from the same content
+        etag, pdf_bytes = render_pdf(conversation, feedback)
+
         # Generate filename with date and time
         current_datetime = datetime.now().strftime("%d-%m-%Y_%H-%M")
         filename = f"Meic-Training-Chat-{current_datetime}.pdf"
-        
+
         # Return PDF as download
-        return send_file(
-            pdf_buffer,
+        response = send_file(
+            BytesIO(pdf_bytes),
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            etag=etag,
+            conditional=False
         )
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    except PDFRendererBusyError as e:
+        print(f"Error: {str(e)}")
+        return jsonify({'error': str(e)}), 503
+    except PDFRenderTimeoutError as e:
+        print(f"Error: {str(e)}")
+        return jsonify({'error': str(e)}), 504
     except Exception as e:
         print(f"Error generating PDF: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# PDF renderer processes re-import this module as __mp_main__ when it is run
+# directly; they must not start background work of their own
+if __name__ != '__mp_main__':
+    if PERSONA_POOL_SIZE > 0:
+        persona_pool.start()
+    analysis_workers.start()
+    chat_workers.start()
+
 if __name__ == '__main__':
     print("Starting Flask server...")
     print("Server will be available at http://127.0.0.1:5000")
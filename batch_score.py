@@ -0,0 +1,178 @@
+"""Score saved transcripts in bulk, outside the web app.
+
+Reads a JSONL file of {"id": ..., "conversation": [...], "persona": {...}}
+records (id is optional and defaults to the line number), runs
+analyze_conversation on them concurrently and appends one JSON line per
+record to the output file as each finishes. A record that can't be scored
+(malformed, or still failing after --retries) gets an {"id", "error"} line
+and the rest carry on. Re-running with the same output file skips records
+that were already scored.
+
+    python batch_score.py transcripts.jsonl scores.jsonl --concurrency 8 --rate 60
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# No persona pool needed when scoring offline
+os.environ.setdefault('PERSONA_POOL_SIZE', '0')
+
+import app  # noqa: E402
+import prompts  # noqa: E402
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per minute, with bursts up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.interval = 60.0 / rate if rate else 0
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+
+def record_problem(record):
+    """Why record can't be scored, or None if it looks complete."""
+    if not isinstance(record.get('id'), (str, int)):
+        return 'id must be a string or number'
+    conversation = record.get('conversation')
+    if not isinstance(conversation, list) or not conversation:
+        return 'conversation must be a non-empty list of messages'
+    if not all(isinstance(msg, dict) and isinstance(msg.get('content'), str) for msg in conversation):
+        return 'every message needs a role and text content'
+    try:
+        app.canonical_conversation(conversation)
+    except (KeyError, ValueError) as e:
+        return str(e)
+    persona = record.get('persona')
+    if not isinstance(persona, dict):
+        return 'persona must be an object'
+    try:
+        prompts.persona_fields(persona)
+    except (KeyError, TypeError, AttributeError) as e:
+        return f'persona is missing or has a malformed {str(e)}'
+    return None
+
+
+def read_records(path):
+    """Yield (record, problem) for each line; problem is None for a scorable record."""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield {'id': line_number}, 'not valid JSON'
+                continue
+            if not isinstance(record, dict):
+                yield {'id': line_number}, 'not a JSON object'
+                continue
+            record.setdefault('id', line_number)
+            yield record, record_problem(record)
+
+
+def completed_ids(path):
+    # Checkpoint: every record already written successfully to the output
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if 'feedback' in result:
+                done.add(result['id'])
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def score_record(record, retries):
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            feedback = app.analyze_conversation(record['conversation'], record['persona'])
+        except Exception as e:
+            # Kept to this record, so the rest of the batch is still written
+            feedback = None
+            error = f'{type(e).__name__}: {str(e)}'
+        if feedback:
+            return {'id': record['id'], 'feedback': feedback}
+        if attempt < retries:
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, min(60, 2 ** attempt)))
+    return {'id': record['id'], 'error': f'Failed after {retries + 1} attempts' + (f' ({error})' if error else '')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score saved training transcripts in bulk.')
+    parser.add_argument('input', help='JSONL file of {id, conversation, persona} records')
+    parser.add_argument('output', help='JSONL file results are appended to')
+    parser.add_argument('--concurrency', type=int, default=8, help='Analyses in flight at once')
+    parser.add_argument('--rate', type=float, default=60,
+                        help='Maximum Gemini calls per minute, counting every call an analysis makes (0 for no limit)')
+    parser.add_argument('--retries', type=int, default=3, help='Retries per failed transcript')
+    args = parser.parse_args(argv)
+
+    done = completed_ids(args.output)
+    records, invalid = [], []
+    for record, problem in read_records(args.input):
+        if problem:
+            invalid.append({'id': record['id'], 'error': f'Invalid record: {problem}'})
+        elif record['id'] not in done:
+            records.append(record)
+    print(f"{len(done)} already scored, {len(records)} to go, {len(invalid)} invalid")
+
+    # Limits each model call rather than each analysis, which can make several
+    app.llm_rate_limiter = RateLimiter(args.rate, burst=args.concurrency)
+    failed = len(invalid)
+    started = time.monotonic()
+
+    with open(args.output, 'a') as out, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        if out.tell() and not ends_with_newline(args.output):
+            out.write('\n')  # don't append onto a line cut short by an interrupted run
+        for result in invalid:
+            out.write(json.dumps(result) + '\n')
+        futures = [pool.submit(score_record, record, args.retries) for record in records]
+        for i, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            if 'error' in result:
+                failed += 1
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            if i % 10 == 0 or i == len(futures):
+                print(f"{i}/{len(futures)} scored ({failed} failed, {time.monotonic() - started:.0f}s)")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Benchmark create_pdf() with a shared ReportTemplate against one built per PDF.
+
+"per-pdf" rebuilds the stylesheet, paragraph styles and table style for every
+document, as create_pdf did before templates were cached; "cached" reuses the
+process-wide template.
+
+    python benchmarks/bench_pdf.py [--runs 20] [--sizes 10 50 200] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_report import ReportTemplate, create_pdf, get_report_template  # noqa: E402
+
+
+def sample_transcript(messages):
+    conversation = []
+    for i in range(messages):
+        role = 'Advisor' if i % 2 == 0 else 'Young Person'
+        conversation.append({
+            'role': role,
+            'content': f"Message {i}: " + "I've been worried about things at school and at home lately. " * 3
+        })
+    return conversation
+
+
+def sample_feedback():
+    feedback = {
+        'conversation_summary': 'The young person talked about money worries and the advisor suggested support services.',
+        'persona': {
+            'age': 16, 'gender': {'identity': 'female'}, 'location': 'Cardiff',
+            'education': {'details': 'In Year 11 at a comprehensive school'},
+            'welsh_family': 'Welsh-speaking family', 'welsh_school': 'Welsh-medium school',
+            'welsh_interest': 'Eisteddfod', 'issue': 'struggling with bills at home',
+            'outcome': 'get help with budgeting'
+        }
+    }
+    for key in ('tone', 'engagement', 'resolution', 'information', 'overall'):
+        feedback[key] = {'score': 75, 'feedback': 'Friendly and clear, could ask more open questions. ' * 2}
+    return feedback
+
+
+def measure(build, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        build()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return {
+        'median_ms': round(statistics.median(times), 2),
+        'p95_ms': round(sorted(times)[int(len(times) * 0.95) - 1], 2),
+        'peak_kib': round(peak / 1024, 1),
+        'retained_blocks': sum(stat.count for stat in snapshot.statistics('filename')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--json', help='Also write results to this file')
+    args = parser.parse_args()
+
+    feedback = sample_feedback()
+    get_report_template()  # build the shared template outside the timings
+
+    results = []
+    for size in args.sizes:
+        conversation = sample_transcript(size)
+        modes = {
+            'per-pdf': lambda: create_pdf(conversation, feedback, template=ReportTemplate()),
+            'cached': lambda: create_pdf(conversation, feedback),
+        }
+        for mode, build in modes.items():
+            result = dict(messages=size, mode=mode, **measure(build, args.runs))
+            results.append(result)
+            print(f"{size:>4} messages  {mode:<8} median {result['median_ms']:>8.2f} ms  "
+                  f"p95 {result['p95_ms']:>8.2f} ms  peak {result['peak_kib']:>8.1f} KiB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
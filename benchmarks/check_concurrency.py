@@ -0,0 +1,300 @@
+"""Re-runnable checks of the code that coordinates concurrent work.
+
+Each check drives the real class with several processes (or threads, where
+the state is per process) against a temporary SQLite file, and prints
+PASS/FAIL for every property it checks:
+
+- singleflight: SQLiteSingleFlight across worker processes. Concurrent
+  duplicates make one call and all get its result; a later, non-concurrent
+  call makes its own; None results and exceptions aren't shared; a waiter
+  takes over from an owner that died; nothing is left in the table.
+- breaker: CircuitBreaker inside ResilientProvider, with concurrent threads.
+  It opens after the threshold and fails fast while open; half-open lets
+  exactly one trial through; a failed trial reopens it, a good one closes
+  it; errors that aren't retried neither count nor reset the count.
+- jobs: SQLiteJobQueue.claim from several worker processes. Every job is
+  claimed exactly once and finished; jobs left running by a dead worker are
+  requeued, recent ones aren't; named queues don't see each other's jobs.
+
+    python benchmarks/check_concurrency.py [singleflight breaker jobs ...]
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import SQLiteJobQueue  # noqa: E402
+from llm import LLMProvider, LLMResponse, TransientLLMError  # noqa: E402
+from resilience import CircuitBreaker, CircuitOpenError, ResilientProvider  # noqa: E402
+from singleflight import SQLiteSingleFlight  # noqa: E402
+
+CALL_SECONDS = 1.0
+
+
+class Checker:
+    def __init__(self):
+        self.failures = 0
+
+    def expect(self, condition, description):
+        print(f"  {'PASS' if condition else 'FAIL'}  {description}")
+        if not condition:
+            self.failures += 1
+
+
+def flight_worker(path, key, behaviour, barrier, calls, results, wait_timeout):
+    flights = SQLiteSingleFlight(path, wait_timeout=wait_timeout, poll_interval=0.02)
+
+    def call():
+        with calls.get_lock():
+            calls.value += 1
+        time.sleep(CALL_SECONDS)
+        if behaviour == 'die':
+            os._exit(1)  # the owner is killed mid-call, leaving its row running
+        if behaviour == 'raise':
+            raise RuntimeError('upstream failed')
+        if behaviour == 'none':
+            return None
+        return {'pid': os.getpid()}
+
+    if barrier is not None:
+        barrier.wait()
+    try:
+        results.put(('ok', os.getpid(), flights.do(key, call, label='check')))
+    except RuntimeError as e:
+        results.put(('error', os.getpid(), str(e)))
+
+
+def run_flights(ctx, path, key, behaviours, wait_timeout=30, stagger=0):
+    """Run one process per behaviour; returns (number of calls made, results)."""
+    calls = ctx.Value('i', 0)
+    results = ctx.Queue()
+    barrier = ctx.Barrier(len(behaviours)) if not stagger else None
+    processes = []
+    for behaviour in behaviours:
+        process = ctx.Process(
+            target=flight_worker, args=(path, key, behaviour, barrier, calls, results, wait_timeout)
+        )
+        process.start()
+        processes.append(process)
+        time.sleep(stagger)
+    outcomes = [results.get(timeout=60) for b in behaviours if b != 'die']
+    for process in processes:
+        process.join()
+    return calls.value, outcomes
+
+
+def flight_rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT COUNT(*) FROM flights').fetchone()[0]
+
+
+def check_singleflight(checker, directory):
+    ctx = multiprocessing.get_context('spawn')
+    path = os.path.join(directory, 'singleflight.db')
+    workers = 6
+
+    calls, outcomes = run_flights(ctx, path, 'shared', ['value'] * workers)
+    values = [value for status, _, value in outcomes if status == 'ok']
+    checker.expect(calls == 1, f"{workers} concurrent duplicates make one call (made {calls})")
+    checker.expect(len(values) == workers and all(v == values[0] for v in values),
+                   'every duplicate gets the same result')
+    checker.expect(flight_rows(path) == 0, 'the shared result is removed once every waiter has read it')
+
+    calls, outcomes = run_flights(ctx, path, 'shared', ['value'])
+    status, pid, value = outcomes[0]
+    checker.expect(calls == 1 and value == {'pid': pid}, 'a later, non-concurrent call makes its own call')
+
+    calls, outcomes = run_flights(ctx, path, 'none', ['none'] * workers)
+    checker.expect(calls == workers, f"a None result isn't shared; each duplicate tries itself ({calls} calls)")
+    checker.expect(all(status == 'ok' and value is None for status, _, value in outcomes),
+                   'every duplicate gets None')
+
+    calls, outcomes = run_flights(ctx, path, 'raise', ['raise'] * workers)
+    checker.expect(calls == workers, f"a failure isn't shared; each duplicate tries itself ({calls} calls)")
+    checker.expect(all(status == 'error' for status, _, _ in outcomes), 'every duplicate gets its own error')
+
+    started = time.monotonic()
+    calls, outcomes = run_flights(ctx, path, 'orphan', ['die', 'value'], wait_timeout=2, stagger=0.3)
+    elapsed = time.monotonic() - started
+    status, pid, value = outcomes[0]
+    checker.expect(calls == 2 and status == 'ok' and value == {'pid': pid},
+                   f"a waiter takes over from an owner that died ({elapsed:.1f}s)")
+    checker.expect(flight_rows(path) == 0, 'no rows are left behind')
+
+
+class ScriptedProvider(LLMProvider):
+    """Answers, or raises `error`, after a short delay; counts upstream calls."""
+
+    name = 'scripted'
+    min_cache_tokens = 0
+
+    def __init__(self):
+        self.error = None
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, contents, system_instruction=None, generation_config=None, timeout=None,
+                 cached_content=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(0.2)
+        if self.error is not None:
+            raise self.error
+        return LLMResponse('ok')
+
+
+def concurrent_calls(provider, count):
+    """Call provider.generate from count threads at once; returns the outcomes."""
+    barrier = threading.Barrier(count)
+    outcomes = []
+    lock = threading.Lock()
+
+    def call():
+        barrier.wait()
+        try:
+            provider.generate('hello')
+            outcome = 'ok'
+        except CircuitOpenError:
+            outcome = 'open'
+        except Exception:
+            outcome = 'error'
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def check_breaker(checker, directory):
+    upstream = ScriptedProvider()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.5)
+    provider = ResilientProvider(upstream, retries=0, breaker=breaker)
+
+    upstream.error = TransientLLMError('overloaded')
+    outcomes = concurrent_calls(provider, 3)
+    checker.expect(outcomes.count('error') == 3 and breaker.state == 'open',
+                   'opens after failure_threshold concurrent failures')
+
+    started = time.monotonic()
+    outcomes = concurrent_calls(provider, 10)
+    elapsed = time.monotonic() - started
+    checker.expect(outcomes.count('open') == 10 and upstream.calls == 3 and elapsed < 0.2,
+                   f"fails fast while open without reaching the upstream ({elapsed * 1000:.0f} ms)")
+
+    time.sleep(0.6)
+    outcomes = concurrent_calls(provider, 8)
+    checker.expect(upstream.calls == 4 and outcomes.count('open') == 7,
+                   f"half-open lets exactly one of 8 concurrent calls through ({upstream.calls - 3} went)")
+    checker.expect(breaker.state == 'open', 'a failed trial reopens the circuit')
+
+    time.sleep(0.6)
+    upstream.error = ValueError('rejected request')
+    concurrent_calls(provider, 1)
+    checker.expect(breaker.state == 'half-open', "an error that isn't retried doesn't close it from a trial")
+
+    upstream.error = None
+    outcomes = concurrent_calls(provider, 8)
+    checker.expect(outcomes.count('ok') >= 1 and breaker.state == 'closed', 'a good trial closes the circuit')
+    outcomes = concurrent_calls(provider, 8)
+    checker.expect(outcomes.count('ok') == 8, 'every call goes through once closed')
+
+    for error in (TransientLLMError('overloaded'), ValueError('rejected'), TransientLLMError('overloaded'),
+                  ValueError('rejected')):
+        upstream.error = error
+        concurrent_calls(provider, 1)
+    checker.expect(breaker.failures == 2 and breaker.state == 'closed',
+                   "errors that aren't retried don't reset the failure count")
+    upstream.error = TransientLLMError('overloaded')
+    concurrent_calls(provider, 1)
+    checker.expect(breaker.state == 'open', 'so interleaved retryable failures still open it')
+
+
+def job_worker(path, barrier, results):
+    job_queue = SQLiteJobQueue(path, poll_interval=0.01)
+    claimed = []
+    barrier.wait()
+    while True:
+        job = job_queue.claim(timeout=0.5)
+        if job is None:
+            break
+        job_id, payload = job
+        time.sleep(0.01)  # a little work, so the workers' claims interleave
+        job_queue.complete(job_id, {'pid': os.getpid(), 'n': payload['n']})
+        claimed.append(job_id)
+    results.put(claimed)
+
+
+def check_jobs(checker, directory):
+    ctx = multiprocessing.get_context('spawn')
+    path = os.path.join(directory, 'jobs.db')
+    job_queue = SQLiteJobQueue(path)
+    job_ids = [job_queue.submit({'n': n}) for n in range(200)]
+
+    workers = 4
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=job_worker, args=(path, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    claimed = [job_id for _ in processes for job_id in results.get(timeout=120)]
+    for process in processes:
+        process.join()
+    jobs = [job_queue.get(job_id) for job_id in job_ids]
+    checker.expect(len(claimed) == len(set(claimed)) == len(job_ids),
+                   f"{workers} processes claim each of {len(job_ids)} jobs exactly once ({len(claimed)} claims)")
+    checker.expect(all(job['status'] == 'done' for job in jobs), 'every job is finished')
+    checker.expect(len({job['result']['pid'] for job in jobs}) > 1, 'the work is spread across processes')
+
+    stale_id = job_queue.submit({'n': 'stale'})
+    recent_id = job_queue.submit({'n': 'recent'})
+    job_queue.claim(timeout=0)
+    job_queue.claim(timeout=0)
+    with sqlite3.connect(path) as conn:
+        conn.execute('UPDATE jobs SET updated = ? WHERE id = ?', (time.time() - 3600, stale_id))
+    SQLiteJobQueue(path, stale_after=600)
+    checker.expect(job_queue.get(stale_id)['status'] == 'queued', 'a job left running by a dead worker is requeued')
+    checker.expect(job_queue.get(recent_id)['status'] == 'running', 'a job still being worked on is not')
+
+    other = SQLiteJobQueue(path, name='chat_jobs')
+    checker.expect(other.claim(timeout=0) is None and other.get(stale_id) is None,
+                   "a named queue doesn't see another queue's jobs")
+
+
+CHECKS = {
+    'singleflight': check_singleflight,
+    'breaker': check_breaker,
+    'jobs': check_jobs,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the coordination of concurrent work.')
+    parser.add_argument('checks', nargs='*', help=f"Checks to run: {', '.join(CHECKS)} (default: all)")
+    args = parser.parse_args(argv)
+    unknown = set(args.checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"unknown check: {', '.join(sorted(unknown))}")
+
+    checker = Checker()
+    for name in args.checks or CHECKS:
+        print(name)
+        with tempfile.TemporaryDirectory() as directory:
+            CHECKS[name](checker, directory)
+    print('All checks passed' if not checker.failures else f"{checker.failures} check(s) failed")
+    return 1 if checker.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""Load test the full request path with simulated trainees.
+
+Each trainee loads /, sends --turns chat messages, ends the chat and
+downloads the PDF, like a real training session. By default (--mode ui) it
+takes the same path as the page: replies stream from /chat-stream, and the
+analysis is queued with an async /end-chat and polled on /jobs/<id> (or
+followed on /jobs/<id>/events with --job-events). --mode sync uses /chat and
+a synchronous /end-chat instead. The script starts gunicorn with
+gunicorn.conf.py against the local LLM stand-in (LLM_PROVIDER=fake); pass
+--url to test a server that is already running.
+
+Reports p50/p95/p99 latency per endpoint, time to first token of streamed
+replies, time from ending the chat to having the analysis, requests per
+second, worker memory (when it started the server) and how cookie and
+request sizes grow with turn count, and writes everything to a JSON file for
+comparing runs.
+
+    python benchmarks/load_test.py --trainees 30 --turns 10 --out results.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADVISOR_MESSAGES = [
+    "Hi, you're through to Meic. What would you like to talk about today?",
+    "That sounds really tough. Can you tell me a bit more about what's been happening?",
+    "How has that been making you feel?",
+    "Have you been able to talk to anyone else about this, like a teacher or family member?",
+    "There are some services that might be able to help. Would you like me to tell you about them?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index], 2)
+
+
+def summarise(values):
+    return {
+        'count': len(values),
+        'mean_ms': round(statistics.mean(values), 2) if values else None,
+        'p50_ms': percentile(values, 50),
+        'p95_ms': percentile(values, 95),
+        'p99_ms': percentile(values, 99),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def child_pids(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def rss_kib(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.timings = defaultdict(list)
+        self.turns = defaultdict(lambda: defaultdict(list))
+
+    def request(self, endpoint, ms, ok):
+        with self.lock:
+            self.latencies[endpoint].append(ms)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def timing(self, name, ms):
+        with self.lock:
+            self.timings[name].append(ms)
+
+    def turn(self, turn, **sizes):
+        with self.lock:
+            for key, value in sizes.items():
+                self.turns[turn][key].append(value)
+
+
+class Trainee:
+    def __init__(self, base_url, recorder, timeout, mode='ui', job_events=False, poll_interval=1.0):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.timeout = timeout
+        self.mode = mode
+        self.job_events = job_events
+        self.poll_interval = poll_interval
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def cookie_bytes(self):
+        return len('; '.join(f'{c.name}={c.value}' for c in self.cookies))
+
+    def _request(self, endpoint, payload, headers=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        headers = dict(headers or {})
+        if data:
+            headers['Content-Type'] = 'application/json'
+        return urllib.request.Request(self.base_url + endpoint, data=data, headers=headers), len(data or b'')
+
+    def call(self, endpoint, payload=None, label=None):
+        request, sent = self._request(endpoint, payload)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                body = response.read()
+                ok = True
+        except (urllib.error.URLError, OSError) as e:
+            body = getattr(e, 'read', lambda: b'')()
+            ok = False
+        ms = (time.perf_counter() - start) * 1000
+        self.recorder.request(label or endpoint, ms, ok)
+        return ok, body, ms, sent
+
+    def stream(self, endpoint, payload=None, label=None, final=('done',)):
+        """Read Server-Sent Events until one of the final events (or 'error').
+
+        Returns (ok, data of the last event, ms, ms to the first text chunk or
+        None, bytes sent); ok means the stream ended with a final event.
+        """
+        request, sent = self._request(endpoint, payload, {'Accept': 'text/event-stream'})
+        start = time.perf_counter()
+        first_ms = None
+        event, data, ok = 'message', None, False
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                for raw in response:
+                    line = raw.decode().rstrip('\r\n')
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data = json.loads(line[5:])
+                        if first_ms is None and 'text' in data:
+                            first_ms = (time.perf_counter() - start) * 1000
+                        if event in final or event == 'error':
+                            ok = event in final
+                            break
+                    elif not line:
+                        event = 'message'
+        except (urllib.error.URLError, OSError, ValueError):
+            ok = False
+        ms = (time.perf_counter() - start) * 1000
+        self.recorder.request(label or endpoint, ms, ok)
+        return ok, data, ms, first_ms, sent
+
+    def send_message(self, message):
+        if self.mode == 'sync':
+            ok, _, ms, sent = self.call('/chat', {'message': message})
+            return ok, ms, sent
+        ok, _, ms, first_ms, sent = self.stream('/chat-stream', {'message': message})
+        if first_ms is not None:
+            self.recorder.timing('time_to_first_token', first_ms)
+        return ok, ms, sent
+
+    def wait_for_job(self, status_url):
+        # Like the page: poll until the job is done or failed
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            ok, body, _, _ = self.call(status_url, label='/jobs/<id>')
+            if not ok:
+                return None
+            job = json.loads(body)
+            if job['status'] == 'done':
+                return job['result']
+            if job['status'] == 'failed':
+                return None
+            time.sleep(self.poll_interval)
+        return None
+
+    def follow_job(self, status_url):
+        ok, job, _, _, _ = self.stream(f'{status_url}/events', label='/jobs/<id>/events', final=('done', 'failed'))
+        return job['result'] if ok and job and job['status'] == 'done' else None
+
+    def end_chat(self, conversation_id):
+        """Return the analysis, or None if ending the chat failed."""
+        if self.mode == 'sync':
+            ok, body, _, _ = self.call('/end-chat', {'conversation_id': conversation_id})
+            return json.loads(body) if ok else None
+        started = time.perf_counter()
+        ok, body, _, _ = self.call('/end-chat', {'conversation_id': conversation_id, 'async': True})
+        if not ok:
+            return None
+        status_url = json.loads(body)['status_url']
+        result = self.follow_job(status_url) if self.job_events else self.wait_for_job(status_url)
+        # A failed job counts as an error, so the exit code reflects it
+        self.recorder.request('analysis', (time.perf_counter() - started) * 1000, result is not None)
+        return result
+
+    def run(self, turns):
+        ok, page, _, _ = self.call('/')
+        match = re.search(rb'const conversationId = "([0-9a-f]+)"', page)
+        if not ok or not match:
+            return
+        conversation_id = match.group(1).decode()
+        for turn in range(1, turns + 1):
+            message = ADVISOR_MESSAGES[(turn - 1) % len(ADVISOR_MESSAGES)]
+            cookie = self.cookie_bytes()
+            ok, ms, sent = self.send_message(message)
+            self.recorder.turn(turn, cookie_bytes=cookie, request_bytes=sent, latency_ms=ms)
+            if not ok:
+                return
+
+        analysis = self.end_chat(conversation_id)
+        if analysis is None:
+            return
+        self.call('/save-chat', {'analysis_id': analysis['analysis_id']})
+
+
+def start_server(port, env_overrides):
+    env = dict(os.environ)
+    env.setdefault('LLM_PROVIDER', 'fake')
+    env.update(env_overrides)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}',
+         'flask_app:application'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return server
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('Server did not start')
+
+
+def sample_memory(server, samples, stop):
+    while not stop.is_set():
+        for pid in child_pids(server.pid) or [server.pid]:
+            rss = rss_kib(pid)
+            if rss is not None:
+                samples[pid] = max(samples.get(pid, 0), rss)
+        stop.wait(0.5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the training bot with simulated trainees.')
+    parser.add_argument('--url', help='Test this running server instead of starting one')
+    parser.add_argument('--trainees', type=int, default=30, help='Concurrent simulated trainees')
+    parser.add_argument('--turns', type=int, default=10, help='Chat messages per trainee')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--mode', choices=('ui', 'sync'), default='ui',
+                        help='ui: /chat-stream and async /end-chat, as the page does; sync: /chat and /end-chat')
+    parser.add_argument('--job-events', action='store_true',
+                        help='In ui mode, follow the analysis on /jobs/<id>/events instead of polling /jobs/<id>')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between /jobs/<id> polls')
+    parser.add_argument('--out', default=os.path.join(ROOT, 'benchmarks', 'results',
+                                                      f'load-{time.strftime("%Y%m%d-%H%M%S")}.json'))
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the started server, e.g. --env FAKE_LLM_LATENCY=1')
+    args = parser.parse_args(argv)
+
+    server = None
+    memory = {}
+    stop = threading.Event()
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        port = free_port()
+        server = start_server(port, dict(item.split('=', 1) for item in args.env))
+        base_url = f'http://127.0.0.1:{port}'
+        threading.Thread(target=sample_memory, args=(server, memory, stop), daemon=True).start()
+
+    recorder = Recorder()
+    trainees = [
+        Trainee(base_url, recorder, args.timeout, args.mode, args.job_events, args.poll_interval)
+        for _ in range(args.trainees)
+    ]
+    threads = [threading.Thread(target=t.run, args=(args.turns,)) for t in trainees]
+    started = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    total = sum(len(v) for v in recorder.latencies.values())
+    results = {
+        'config': {
+            'url': args.url, 'trainees': args.trainees, 'turns': args.turns, 'env': args.env,
+            'mode': args.mode, 'job_events': args.job_events,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'duration_s': round(elapsed, 2),
+        'requests': total,
+        'requests_per_second': round(total / elapsed, 2),
+        'endpoints': {
+            endpoint: dict(summarise(values), errors=recorder.errors[endpoint])
+            for endpoint, values in recorder.latencies.items()
+        },
+        'timings': {name: summarise(values) for name, values in recorder.timings.items()},
+        'worker_rss_kib': {str(pid): rss for pid, rss in memory.items()},
+        'per_turn': {
+            turn: {
+                'cookie_bytes': max(data['cookie_bytes']),
+                'request_bytes': max(data['request_bytes']),
+                'latency_p50_ms': percentile(data['latency_ms'], 50),
+            }
+            for turn, data in sorted(recorder.turns.items())
+        },
+    }
+
+    print(f"{total} requests in {elapsed:.1f}s ({results['requests_per_second']} req/s)")
+    for endpoint, stats in results['endpoints'].items():
+        print(f"  {endpoint:<18} n={stats['count']:<5} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+              f"p99 {stats['p99_ms']:>8} ms  errors {stats['errors']}")
+    for name, stats in results['timings'].items():
+        print(f"  {name}: p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms")
+    if memory:
+        print(f"  worker RSS: {', '.join(f'{rss / 1024:.1f} MiB' for rss in memory.values())}")
+    turns = results['per_turn']
+    if turns:
+        first, last = turns[min(turns)], turns[max(turns)]
+        print(f"  cookie bytes turn 1 -> {max(turns)}: {first['cookie_bytes']} -> {last['cookie_bytes']}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+    # Non-zero exit when any request failed, so a run doubles as a check of the server config
+    return 1 if any(recorder.errors.values()) or not total else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Small thread-safe caches: in-memory LRU, on-disk files, and the two tiered."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+_HEX_DIGITS = frozenset('0123456789abcdef')
+_TEMP_PREFIX = '.tmp-'
+
+
+def is_hex_key(key):
+    """True for a non-empty lowercase hex string, the only keys DiskCache accepts."""
+    return isinstance(key, str) and bool(key) and _HEX_DIGITS.issuperset(key)
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        # ttl is in seconds; None means entries only leave by LRU eviction
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, expires_at, now):
+        return expires_at is not None and expires_at <= now
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if self._expired(expires_at, time.monotonic()):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        if entry is _MISSING or self._expired(entry[0], time.monotonic()):
+            return default
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class DiskCache:
+    """One file per key under a directory; entries expire by file age.
+
+    A key that is never read again would never be found expired, so set()
+    also starts a background sweep of the cache's own files at most once per
+    sweep_interval seconds. Anything else in the directory is left alone.
+    """
+
+    def __init__(self, directory, ttl=None, binary=False, sweep_interval=60 * 60):
+        # binary=True stores bytes as-is, otherwise values are JSON
+        self.directory = directory
+        self.ttl = ttl
+        self.binary = binary
+        self.sweep_interval = sweep_interval
+        # The first set() sweeps, clearing out whatever earlier runs left behind
+        self._next_sweep = time.monotonic()
+        self._sweep_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        # Keys are hashes or IDs; refusing anything else keeps every path inside directory
+        if not is_hex_key(key):
+            raise ValueError(f"Invalid disk cache key: {key!r}")
+        return os.path.join(self.directory, key[:2], key + ('.bin' if self.binary else '.json'))
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl <= time.time():
+                os.remove(path)
+                return default
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, OSError):
+            return default
+        try:
+            return data if self.binary else json.loads(data)
+        except ValueError:
+            return default
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = value if self.binary else json.dumps(value).encode()
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=_TEMP_PREFIX)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        with self._sweep_lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.sweep_interval
+        threading.Thread(target=self._sweep, name='disk-cache-sweep', daemon=True).start()
+
+    def _sweep(self):
+        try:
+            removed = self.purge_expired()
+        except OSError as e:
+            print(f"Error sweeping {self.directory}: {str(e)}")
+            return
+        if removed:
+            print(f"Removed {removed} expired entries from {self.directory}")
+
+    def _own_files(self):
+        # Only files in this cache's layout (<2 hex>/<hex key><suffix>, and
+        # interrupted writes), so a shared directory keeps everything else
+        suffix = '.bin' if self.binary else '.json'
+        for prefix in os.listdir(self.directory):
+            folder = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not is_hex_key(prefix) or not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                key = name[:-len(suffix)] if name.endswith(suffix) else None
+                if name.startswith(_TEMP_PREFIX) or (key and key.startswith(prefix) and is_hex_key(key)):
+                    yield os.path.join(folder, name)
+
+    def purge_expired(self):
+        """Delete expired entries, and temp files left by an interrupted write."""
+        if not self.ttl:
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for path in self._own_files():
+            try:
+                if os.path.getmtime(path) <= cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                # Already removed by another worker's sweep or get()
+                pass
+        return removed
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+
+class TieredCache:
+    """Memory LRU in front of an optional disk cache."""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def pop(self, key, default=None):
+        value = self.memory.pop(key, _MISSING)
+        if self.disk is not None:
+            disk_value = self.disk.pop(key, _MISSING)
+            if value is _MISSING:
+                value = disk_value
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+
+def content_key(*parts):
+    """Stable SHA-256 over JSON-serialisable parts."""
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
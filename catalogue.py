@@ -0,0 +1,157 @@
+"""Persona catalogue loaded from data/persona_catalogue.json.
+
+The JSON file is read once into flat tuples, and a persona is a short list
+of indices into them:
+
+    [version, age, gender, location, scenario, communication, education,
+     welsh_school, welsh_interest, welsh_family, welsh_community, youth_interest]
+
+That list is what the session and job queue store; expand() turns it back
+into the full persona dict when a prompt or report needs it. version is a
+hash of the catalogue file, so a reference made against an older catalogue
+is rejected instead of silently pointing at different entries. Editing the
+JSON file and restarting changes the catalogue without a code change.
+
+Themes are drawn in O(1) from an alias table built from theme_weights, and
+sample_theme() can skip themes a trainee has seen recently.
+"""
+import hashlib
+import json
+import os
+import random
+from functools import lru_cache
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'persona_catalogue.json')
+
+
+class StaleCatalogueError(ValueError):
+    """A persona reference was made against a different catalogue."""
+
+
+class AliasTable:
+    """Walker/Vose alias table: O(1) draws from a fixed weighted distribution."""
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Anything left over is 1.0 up to rounding error
+
+    def draw(self, rng=random):
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+class PersonaCatalogue:
+    def __init__(self, data, version):
+        self.version = version
+        self.ages = tuple(range(data['age_range'][0], data['age_range'][1] + 1))
+        self.genders = tuple(data['gender_identities'])
+        self.locations = tuple(data['locations'])
+        self.communication_styles = tuple(data['communication_styles'])
+        self.education_scenarios = tuple(data['education_scenarios'])
+        welsh = data['welsh_references']
+        self.welsh_schools = tuple(welsh['schools'])
+        self.welsh_interests = tuple(welsh['interests'])
+        self.welsh_families = tuple(welsh['family'])
+        self.welsh_communities = tuple(welsh['communities'])
+
+        # Scenarios and youth interests are flattened, with a choice table per
+        # theme / category so a draw stays "pick a theme, then a scenario"
+        self.themes = tuple(data['themes'])
+        weights = data.get('theme_weights', {})
+        self.theme_weights = tuple(float(weights.get(theme, 1)) for theme in self.themes)
+        self.theme_table = AliasTable(self.theme_weights)
+        self.scenarios = tuple(
+            (theme, s['issue'], s['outcome'], s['details'])
+            for theme in self.themes for s in data['themes'][theme]
+        )
+        self.scenarios_by_theme = tuple(
+            tuple(i for i, s in enumerate(self.scenarios) if s[0] == theme) for theme in self.themes
+        )
+        self.youth_interests = tuple(
+            (group['category'], interest)
+            for group in data['youth_interests'] for interest in group['interests']
+        )
+        categories = tuple(group['category'] for group in data['youth_interests'])
+        self.interests_by_category = tuple(
+            tuple(i for i, item in enumerate(self.youth_interests) if item[0] == category)
+            for category in categories
+        )
+
+    def sample_theme(self, rng=random, exclude=()):
+        """Draw a theme index by weight, avoiding those in exclude where possible."""
+        exclude = set(exclude)
+        # Rejection keeps draws O(1) while a good share of the weight is allowed
+        for _ in range(8):
+            theme = self.theme_table.draw(rng)
+            if theme not in exclude:
+                return theme
+        allowed = [i for i in range(len(self.themes)) if i not in exclude and self.theme_weights[i] > 0]
+        if not allowed:
+            return self.theme_table.draw(rng)
+        return rng.choices(allowed, weights=[self.theme_weights[i] for i in allowed])[0]
+
+    def sample(self, rng=random, theme=None):
+        """Draw a random persona reference, optionally for a given theme index."""
+        if theme is None:
+            theme = self.theme_table.draw(rng)
+        return [
+            self.version,
+            rng.randrange(len(self.ages)),
+            rng.randrange(len(self.genders)),
+            rng.randrange(len(self.locations)),
+            rng.choice(self.scenarios_by_theme[theme]),
+            rng.randrange(len(self.communication_styles)),
+            rng.randrange(len(self.education_scenarios)),
+            rng.randrange(len(self.welsh_schools)),
+            rng.randrange(len(self.welsh_interests)),
+            rng.randrange(len(self.welsh_families)),
+            rng.randrange(len(self.welsh_communities)),
+            rng.choice(rng.choice(self.interests_by_category)),
+        ]
+
+    def expand(self, ref):
+        """Return the full persona dict for a reference from sample()."""
+        if not ref or ref[0] != self.version:
+            raise StaleCatalogueError('Persona reference does not match the loaded catalogue')
+        (_, age, gender, location, scenario, communication, education,
+         school, interest, family, community, youth_interest) = ref
+        theme, issue, outcome, details = self.scenarios[scenario]
+        category, youth = self.youth_interests[youth_interest]
+        return {
+            "age": self.ages[age],
+            "gender": dict(self.genders[gender]),
+            "location": self.locations[location],
+            "theme": theme,
+            "issue": issue,
+            "outcome": outcome,
+            "details": details,
+            "communication": dict(self.communication_styles[communication]),
+            "education": dict(self.education_scenarios[education]),
+            "welsh_school": self.welsh_schools[school],
+            "welsh_interest": self.welsh_interests[interest],
+            "welsh_family": self.welsh_families[family],
+            "welsh_community": self.welsh_communities[community],
+            "youth_interest_category": category,
+            "youth_interest": youth
+        }
+
+
+@lru_cache(maxsize=None)
+def load_catalogue(path=None):
+    path = path or os.getenv('PERSONA_CATALOGUE', DEFAULT_PATH)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    version = hashlib.sha256(raw).hexdigest()[:8]
+    return PersonaCatalogue(json.loads(raw), version)
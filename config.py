@@ -0,0 +1,18 @@
+"""Helpers for reading settings from the environment."""
+import os
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def env_flag(name, default=False):
+    """Read an on/off setting. Unset or empty gives default; anything that
+    isn't a recognised on or off value is an error rather than silently off."""
+    value = os.getenv(name, '').strip().lower()
+    if not value:
+        return default
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"{name} must be one of {', '.join(TRUE_VALUES + FALSE_VALUES)}, not {value!r}")
@@ -0,0 +1,146 @@
+"""Explicit context caching of static system instructions.
+
+ContextCachingProvider wraps another provider. A call that passes cache_key
+alongside its system_instruction (the persona prompt's template version and
+persona reference, or the analysis rubric's version) has the instruction
+cached upstream on first use. Later calls with the same key send only the
+cache name, so the provider doesn't re-read and re-bill the instruction at
+full price every turn.
+
+Handles are kept in a local LRU registry and their TTL is extended when a
+call comes in close to expiry. If the provider can't cache (no support,
+instruction below its minimum size, or an API error) or a cache has
+vanished upstream, the call falls back to sending the instruction in full.
+"""
+import os
+import time
+
+import metrics
+from cache import LRUCache
+from config import env_flag
+from llm import CachedContentMissingError, LLMProvider, LLMStream
+
+_UNAVAILABLE = 'unavailable'
+
+
+class ContextCachingProvider(LLMProvider):
+    def __init__(self, provider, enabled=True, ttl=600, refresh_margin=120, min_tokens=None,
+                 retry_after=300, maxsize=1024):
+        self.provider = provider
+        self.name = provider.name
+        self.enabled = enabled
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = provider.min_cache_tokens if min_tokens is None else min_tokens
+        self.retry_after = retry_after
+        # cache_key -> CacheHandle, or _UNAVAILABLE while caching it isn't possible
+        self._handles = LRUCache(maxsize=maxsize)
+
+    @classmethod
+    def from_env(cls, provider):
+        min_tokens = os.getenv('CONTEXT_CACHE_MIN_TOKENS')
+        return cls(
+            provider,
+            enabled=env_flag('CONTEXT_CACHE', default=True),
+            ttl=int(os.getenv('CONTEXT_CACHE_TTL', 600)),
+            refresh_margin=int(os.getenv('CONTEXT_CACHE_REFRESH', 120)),
+            min_tokens=int(min_tokens) if min_tokens else None
+        )
+
+    def _lookup(self, cache_key, system_instruction):
+        """Return a cache name for this instruction, or None to send it in full."""
+        entry = self._handles.get(cache_key)
+        if entry == _UNAVAILABLE:
+            metrics.CONTEXT_CACHE.inc(outcome='unavailable')
+            return None
+        now = time.time()
+        if entry is not None and entry.expires_at - now > self.refresh_margin:
+            metrics.CONTEXT_CACHE.inc(outcome='hit')
+            return entry.name
+
+        if len(system_instruction) // 4 < self.min_tokens:
+            # Too small for the provider to cache; it won't grow, so don't retry
+            self._handles.set(cache_key, _UNAVAILABLE)
+            metrics.CONTEXT_CACHE.inc(outcome='too_small')
+            return None
+        try:
+            handle = None
+            if entry is not None and entry.expires_at > now:
+                try:
+                    handle = self.provider.refresh_cache(entry, self.ttl)
+                    outcome = 'refresh'
+                except CachedContentMissingError:
+                    pass
+            if handle is None:
+                handle = self.provider.create_cache(system_instruction, self.ttl)
+                outcome = 'create'
+        except NotImplementedError:
+            print(f"Provider {self.name} has no context caching, sending system instructions in full")
+            self.enabled = False
+            return None
+        except Exception as e:
+            print(f"Context cache unavailable ({type(e).__name__}: {str(e)}), sending the system instruction in full")
+            self._handles.set(cache_key, _UNAVAILABLE, ttl=self.retry_after)
+            metrics.CONTEXT_CACHE.inc(outcome='error')
+            return None
+        self._handles.set(cache_key, handle, ttl=max(handle.expires_at - time.time(), 1))
+        metrics.CONTEXT_CACHE.inc(outcome=outcome)
+        return handle.name
+
+    def _cached_kwargs(self, cache_key, kwargs):
+        if not (self.enabled and cache_key is not None and kwargs.get('system_instruction')):
+            return None
+        name = self._lookup(cache_key, kwargs['system_instruction'])
+        if name is None:
+            return None
+        return dict(kwargs, system_instruction=None, cached_content=name)
+
+    def _missing(self, cache_key):
+        # Expired or deleted upstream before our TTL said so; recreated next call
+        self._handles.pop(cache_key)
+        metrics.CONTEXT_CACHE.inc(outcome='missing')
+
+    def generate(self, contents, system_instruction=None, generation_config=None, timeout=None,
+                 cached_content=None, cache_key=None):
+        kwargs = dict(system_instruction=system_instruction, generation_config=generation_config,
+                      timeout=timeout, cached_content=cached_content)
+        cached_kwargs = self._cached_kwargs(cache_key, kwargs)
+        if cached_kwargs is not None:
+            try:
+                return self.provider.generate(contents, **cached_kwargs)
+            except CachedContentMissingError:
+                self._missing(cache_key)
+        return self.provider.generate(contents, **kwargs)
+
+    def stream(self, contents, system_instruction=None, generation_config=None, timeout=None,
+               cached_content=None, cache_key=None):
+        kwargs = dict(system_instruction=system_instruction, generation_config=generation_config,
+                      timeout=timeout, cached_content=cached_content)
+
+        def chunks(stream):
+            cached_kwargs = self._cached_kwargs(cache_key, kwargs)
+            if cached_kwargs is not None:
+                inner = self.provider.stream(contents, **cached_kwargs)
+                started = False
+                try:
+                    for text in inner:
+                        started = True
+                        yield text
+                    stream.usage = inner.usage
+                    return
+                except CachedContentMissingError:
+                    # Only before the first chunk; after that the reply is already out
+                    if started:
+                        raise
+                    self._missing(cache_key)
+            inner = self.provider.stream(contents, **kwargs)
+            yield from inner
+            stream.usage = inner.usage
+
+        return LLMStream(chunks)
+
+    def create_cache(self, system_instruction, ttl):
+        return self.provider.create_cache(system_instruction, ttl)
+
+    def refresh_cache(self, handle, ttl):
+        return self.provider.refresh_cache(handle, ttl)
@@ -0,0 +1,22 @@
+"""Gunicorn settings for the training bot.
+
+Most of a /chat or /end-chat request is spent waiting on Gemini, so each
+worker process serves up to GUNICORN_THREADS requests on a thread pool
+(gthread). The app's own background threads, renderer processes and
+SQLite backends all assume real threads, so there is no gevent option.
+
+With more than one worker process, set SESSION_BACKEND=sqlite so every
+worker sees the same sessions. Check a change to these settings with
+benchmarks/load_test.py (see the README), which exits non-zero if any
+request failed.
+"""
+import os
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+# Long analysis calls must not trip the worker timeout
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
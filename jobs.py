@@ -0,0 +1,213 @@
+"""Background job queue for slow work such as end-of-chat analysis.
+
+A queue backend stores jobs and their results; a JobWorkerPool runs them on
+local threads. Job states: queued -> running -> done | failed.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from cache import LRUCache
+
+
+class JobQueue:
+    """Interface for queue backends. Payloads and results must be JSON-serialisable."""
+
+    def submit(self, payload):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def claim(self, timeout=1.0):
+        """Return (job_id, payload) for the next queued job, or None."""
+        raise NotImplementedError
+
+    def complete(self, job_id, result):
+        raise NotImplementedError
+
+    def fail(self, job_id, error):
+        raise NotImplementedError
+
+
+class MemoryJobQueue(JobQueue):
+    """In-process queue. Jobs are lost on restart."""
+
+    def __init__(self, max_jobs=1000, ttl=60 * 60):
+        self._pending = queue.Queue()
+        self._jobs = LRUCache(maxsize=max_jobs, ttl=ttl)
+
+    def _update(self, job_id, **fields):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self._jobs.set(job_id, dict(job, updated=time.time(), **fields))
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._jobs.set(job_id, {
+            'id': job_id, 'status': 'queued', 'result': None, 'error': None,
+            'created': now, 'updated': now
+        })
+        self._pending.put((job_id, payload))
+        return job_id
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def claim(self, timeout=1.0):
+        try:
+            job_id, payload = self._pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self._update(job_id, status='running')
+        return job_id, payload
+
+    def complete(self, job_id, result):
+        self._update(job_id, status='done', result=result)
+
+    def fail(self, job_id, error):
+        self._update(job_id, status='failed', error=error)
+
+
+class SQLiteJobQueue(JobQueue):
+    """Durable queue in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path='jobs.db', ttl=24 * 60 * 60, stale_after=10 * 60, poll_interval=0.5, name='jobs'):
+        # Each named queue is its own table, so workers only claim their kind of job
+        if not name.isidentifier():
+            raise ValueError(f"Invalid queue name: {name}")
+        self.path = path
+        self.table = name
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, '
+                'result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_status ON {self.table} (status, created)')
+            # Jobs left running by a worker that died are picked up again
+            conn.execute(
+                f"UPDATE {self.table} SET status = 'queued' WHERE status = 'running' AND updated < ?",
+                (time.time() - stale_after,)
+            )
+            conn.execute(f'DELETE FROM {self.table} WHERE created < ?', (time.time() - ttl,))
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            f"INSERT INTO {self.table} (id, status, payload, created, updated) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, json.dumps(payload), now, now)
+        )
+        return job_id
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            f'SELECT id, status, result, error, created, updated FROM {self.table} WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0], 'status': row[1], 'result': json.loads(row[2]) if row[2] else None,
+            'error': row[3], 'created': row[4], 'updated': row[5]
+        }
+
+    def claim(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        conn = self._connect()
+        while True:
+            # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same job
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    f"SELECT id, payload FROM {self.table} WHERE status = 'queued' ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        f"UPDATE {self.table} SET status = 'running', updated = ? WHERE id = ?",
+                        (time.time(), row[0])
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if row is not None:
+                return row[0], json.loads(row[1])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def complete(self, job_id, result):
+        self._connect().execute(
+            f"UPDATE {self.table} SET status = 'done', result = ?, updated = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job_id, error):
+        self._connect().execute(
+            f"UPDATE {self.table} SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+            (error, time.time(), job_id)
+        )
+
+
+def create_job_queue(backend=None, name='jobs'):
+    backend = backend or os.getenv('JOB_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryJobQueue()
+    if backend == 'sqlite':
+        return SQLiteJobQueue(path=os.getenv('JOB_DB_PATH', 'jobs.db'), name=name)
+    raise ValueError(f"Unknown JOB_BACKEND: {backend}")
+
+
+class JobWorkerPool:
+    """Runs handler(payload) for queued jobs on a fixed number of threads."""
+
+    def __init__(self, job_queue, handler, workers=4, name='job-worker'):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.workers = workers
+        self.name = name
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            try:
+                claimed = self.job_queue.claim()
+            except Exception as e:
+                print(f"Error claiming job: {str(e)}")
+                time.sleep(1)
+                continue
+            if claimed is None:
+                continue
+            job_id, payload = claimed
+            try:
+                self.job_queue.complete(job_id, self.handler(payload))
+            except Exception as e:
+                print(f"Error in job {job_id}: {str(e)}")
+                self.job_queue.fail(job_id, str(e))
@@ -0,0 +1,360 @@
+"""LLM providers used by the chat and analysis code.
+
+GeminiProvider talks to the Gemini API. FakeProvider is a local,
+deterministic stand-in with configurable latency, streaming rate and error
+injection, for load tests and benchmarks without a live API. Pick one with
+LLM_PROVIDER=gemini|fake.
+
+Providers may also support explicit context caching: create_cache() stores a
+system instruction upstream and returns a handle whose name can be passed as
+cached_content instead of resending the instruction (see context_cache.py).
+"""
+import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from cache import LRUCache
+
+
+class TransientLLMError(Exception):
+    """A failure worth retrying (rate limit, overload, timeout)."""
+
+
+class LLMTimeoutError(TransientLLMError):
+    pass
+
+
+class CachedContentMissingError(Exception):
+    """The cached content named in a call has expired or been deleted upstream."""
+
+
+class CacheHandle:
+    def __init__(self, name, expires_at):
+        self.name = name
+        # Wall-clock time (time.time()) the upstream cache expires
+        self.expires_at = expires_at
+
+
+class LLMResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        # prompt_tokens, response_tokens and cached_tokens, where known
+        self.usage = usage or {}
+
+
+class LLMStream:
+    """Iterates over text chunks; usage is filled in once the stream is exhausted."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.usage = {}
+
+    def __iter__(self):
+        return iter(self._chunks(self))
+
+
+class LLMProvider:
+    name = 'base'
+    # Smallest system instruction, in tokens, the provider will cache
+    min_cache_tokens = 0
+
+    def generate(self, contents, system_instruction=None, generation_config=None, timeout=None,
+                 cached_content=None):
+        """Return an LLMResponse. contents is a prompt string or a list of role-tagged turns;
+        timeout is in seconds; cached_content names a cache from create_cache() and
+        replaces system_instruction."""
+        raise NotImplementedError
+
+    def stream(self, contents, system_instruction=None, generation_config=None, timeout=None,
+               cached_content=None):
+        """Return an LLMStream of text chunks."""
+        raise NotImplementedError
+
+    def create_cache(self, system_instruction, ttl):
+        """Cache system_instruction upstream for ttl seconds and return a CacheHandle.
+        Providers without explicit caching raise NotImplementedError."""
+        raise NotImplementedError
+
+    def refresh_cache(self, handle, ttl):
+        """Extend a cache to ttl seconds from now and return the updated CacheHandle."""
+        raise NotImplementedError
+
+
+def _gemini_usage(usage_metadata):
+    if usage_metadata is None:
+        return {}
+    return {
+        'prompt_tokens': usage_metadata.prompt_token_count,
+        'response_tokens': usage_metadata.candidates_token_count,
+        'cached_tokens': usage_metadata.cached_content_token_count,
+    }
+
+
+class GeminiProvider(LLMProvider):
+    name = 'gemini'
+    # Gemini rejects explicit caches smaller than this
+    min_cache_tokens = 4096
+
+    def __init__(self, api_key, model_name='gemini-2.0-flash'):
+        import google.generativeai as genai
+        from google.api_core import exceptions as google_exceptions
+
+        self.genai = genai
+        self.google_exceptions = google_exceptions
+        self.model_name = model_name
+        genai.configure(api_key=api_key)
+        self._default_model = genai.GenerativeModel(model_name)
+        # Models bound to cached contents, by cache name
+        self._cached_models = LRUCache(maxsize=256)
+
+    def _model(self, system_instruction, cached_content=None):
+        if cached_content:
+            model = self._cached_models.get(cached_content)
+            if model is None:
+                model = self.genai.GenerativeModel.from_cached_content(cached_content)
+                self._cached_models.set(cached_content, model)
+            return model
+        if not system_instruction:
+            return self._default_model
+        return self.genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+
+    def _request_options(self, timeout):
+        return {'timeout': timeout} if timeout else None
+
+    def _generate_content(self, contents, system_instruction, cached_content, **kwargs):
+        try:
+            return self._model(system_instruction, cached_content).generate_content(contents, **kwargs)
+        except (self.google_exceptions.NotFound, self.google_exceptions.PermissionDenied) as e:
+            if not cached_content:
+                raise
+            self._cached_models.pop(cached_content)
+            raise CachedContentMissingError(str(e)) from e
+
+    def generate(self, contents, system_instruction=None, generation_config=None, timeout=None,
+                 cached_content=None):
+        response = self._generate_content(
+            contents, system_instruction, cached_content,
+            generation_config=generation_config, request_options=self._request_options(timeout)
+        )
+        return LLMResponse(response.text, _gemini_usage(response.usage_metadata))
+
+    def stream(self, contents, system_instruction=None, generation_config=None, timeout=None,
+               cached_content=None):
+        response = self._generate_content(
+            contents, system_instruction, cached_content,
+            generation_config=generation_config, stream=True,
+            request_options=self._request_options(timeout)
+        )
+
+        def chunks(stream):
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. only safety metadata)
+                    continue
+                if text:
+                    yield text
+            stream.usage = _gemini_usage(response.usage_metadata)
+
+        return LLMStream(chunks)
+
+    def _handle(self, cached):
+        return CacheHandle(cached.name, cached.expire_time.timestamp())
+
+    def create_cache(self, system_instruction, ttl):
+        cached = self.genai.caching.CachedContent.create(
+            model=self.model_name, system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+        return self._handle(cached)
+
+    def refresh_cache(self, handle, ttl):
+        try:
+            cached = self.genai.caching.CachedContent.get(handle.name)
+            cached.update(ttl=datetime.timedelta(seconds=ttl))
+        except self.google_exceptions.NotFound as e:
+            raise CachedContentMissingError(str(e)) from e
+        return self._handle(cached)
+
+
+FAKE_REPLIES = [
+    "Hiya, I'm not really sure how to start this but things have been hard lately.",
+    "It's mostly stuff at home, mam and dad are stressed all the time.",
+    "I haven't really told anyone at school about it, it's a bit embarrassing.",
+    "Yeah I suppose that could help, I just don't know who to ask.",
+    "Diolch, that actually makes me feel a bit better.",
+    "I'm worried it'll get worse if I say something though.",
+]
+
+
+class FakeProvider(LLMProvider):
+    """Deterministic local model: the same input always gives the same output.
+
+    latency is the delay before the first token, tokens_per_second the
+    generation rate after it, error_rate the fraction of calls that raise
+    TransientLLMError. prefill_tokens_per_second adds time for reading the
+    prompt; cached system instructions (create_cache) skip it and are
+    reported as cached_tokens, like Gemini's context caching.
+    """
+    name = 'fake'
+
+    def __init__(self, latency=0.5, tokens_per_second=50, response_tokens=40, error_rate=0.0, seed=0,
+                 prefill_tokens_per_second=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.seed = seed
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self._errors = random.Random(seed)
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def create_cache(self, system_instruction, ttl):
+        name = 'cachedContents/fake-' + hashlib.sha256(system_instruction.encode()).hexdigest()[:16]
+        now = time.time()
+        with self._lock:
+            self._caches = {k: v for k, v in self._caches.items() if v[1] > now}
+            self._caches[name] = (system_instruction, now + ttl)
+        return CacheHandle(name, now + ttl)
+
+    def refresh_cache(self, handle, ttl):
+        system_instruction = self._cached_instruction(handle.name)
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._caches[handle.name] = (system_instruction, expires_at)
+        return CacheHandle(handle.name, expires_at)
+
+    def _cached_instruction(self, name):
+        with self._lock:
+            entry = self._caches.get(name)
+        if entry is None or entry[1] <= time.time():
+            raise CachedContentMissingError(f'Cached content {name} not found')
+        return entry[0]
+
+    def _resolve(self, system_instruction, cached_content):
+        # Returns the effective system instruction and how many of its tokens were cached
+        if not cached_content:
+            return system_instruction, 0
+        system_instruction = self._cached_instruction(cached_content)
+        return system_instruction, len(system_instruction) // 4
+
+    def _prefill(self, usage):
+        if not self.prefill_tokens_per_second:
+            return 0
+        return (usage['prompt_tokens'] - usage['cached_tokens']) / self.prefill_tokens_per_second
+
+    def _rng(self, contents, system_instruction):
+        digest = hashlib.sha256(json.dumps([self.seed, system_instruction, contents]).encode()).digest()
+        return random.Random(digest)
+
+    def _maybe_fail(self):
+        with self._lock:
+            failed = self._errors.random() < self.error_rate
+        if failed:
+            time.sleep(self.latency)
+            raise TransientLLMError('Injected fake LLM failure')
+
+    def _text(self, rng, contents, system_instruction, generation_config):
+        schema = (generation_config or {}).get('response_schema')
+        if schema:
+            return json.dumps(self._from_schema(rng, schema))
+        if 'CONVERSATION_SUMMARY:' in (system_instruction or '') + (contents if isinstance(contents, str) else ''):
+            return self._legacy_analysis(rng)
+        words = []
+        while len(words) < self.response_tokens:
+            words.extend(rng.choice(FAKE_REPLIES).split())
+        return ' '.join(words[:self.response_tokens])
+
+    def _from_schema(self, rng, schema):
+        kind = schema.get('type')
+        if kind == 'object':
+            return {key: self._from_schema(rng, sub) for key, sub in schema.get('properties', {}).items()}
+        if kind == 'array':
+            return [self._from_schema(rng, schema.get('items', {})) for _ in range(2)]
+        if kind == 'integer':
+            return rng.randint(40, 95)
+        if kind == 'number':
+            return round(rng.uniform(40, 95), 1)
+        if kind == 'boolean':
+            return rng.random() < 0.5
+        return ' '.join(rng.choice(FAKE_REPLIES).split()[:12])
+
+    def _legacy_analysis(self, rng):
+        lines = ['CONVERSATION_SUMMARY: ' + rng.choice(FAKE_REPLIES), 'ABOUT_YOUNG_PERSON: A young person from Wales.']
+        for label in ('TONE', 'ENGAGEMENT', 'RESOLUTION', 'INFORMATION', 'OVERALL'):
+            lines.append(f'{label}_SCORE: {rng.randint(40, 95)}')
+            lines.append(f'{label}_FEEDBACK: ' + rng.choice(FAKE_REPLIES))
+        return '\n'.join(lines)
+
+    def _usage(self, contents, system_instruction, text, cached_tokens=0):
+        # Roughly four characters per token, like the real tokenizer on English.
+        # prompt_tokens includes the cached part, as Gemini reports it
+        prompt_tokens = len(json.dumps(contents)) // 4 + len(system_instruction or '') // 4
+        return {'prompt_tokens': prompt_tokens, 'response_tokens': len(text) // 4, 'cached_tokens': cached_tokens}
+
+    def _wait(self, seconds, timeout):
+        # Emulate a request deadline: give up after `timeout` like the real client
+        if timeout and seconds > timeout:
+            time.sleep(timeout)
+            raise LLMTimeoutError(f'Fake LLM call exceeded {timeout}s deadline')
+        time.sleep(seconds)
+
+    def generate(self, contents, system_instruction=None, generation_config=None, timeout=None,
+                 cached_content=None):
+        system_instruction, cached_tokens = self._resolve(system_instruction, cached_content)
+        self._maybe_fail()
+        text = self._text(self._rng(contents, system_instruction), contents, system_instruction, generation_config)
+        usage = self._usage(contents, system_instruction, text, cached_tokens)
+        tokens = len(text.split())
+        self._wait(
+            self.latency + self._prefill(usage) + (tokens / self.tokens_per_second if self.tokens_per_second else 0),
+            timeout
+        )
+        return LLMResponse(text, usage)
+
+    def stream(self, contents, system_instruction=None, generation_config=None, timeout=None,
+               cached_content=None):
+        system_instruction, cached_tokens = self._resolve(system_instruction, cached_content)
+        self._maybe_fail()
+        text = self._text(self._rng(contents, system_instruction), contents, system_instruction, generation_config)
+        usage = self._usage(contents, system_instruction, text, cached_tokens)
+
+        def chunks(stream):
+            self._wait(self.latency + self._prefill(usage), timeout)
+            words = text.split(' ')
+            for i in range(0, len(words), 5):
+                piece = ' '.join(words[i:i + 5])
+                if self.tokens_per_second:
+                    time.sleep(len(words[i:i + 5]) / self.tokens_per_second)
+                yield piece if i + 5 >= len(words) else piece + ' '
+            stream.usage = usage
+
+        return LLMStream(chunks)
+
+
+def create_provider(name=None):
+    name = name or os.getenv('LLM_PROVIDER', 'gemini')
+    if name == 'gemini':
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set")
+        return GeminiProvider(
+            api_key,
+            model_name=os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+        )
+    if name == 'fake':
+        return FakeProvider(
+            latency=float(os.getenv('FAKE_LLM_LATENCY', 0.5)),
+            tokens_per_second=float(os.getenv('FAKE_LLM_TOKENS_PER_SEC', 50)),
+            response_tokens=int(os.getenv('FAKE_LLM_RESPONSE_TOKENS', 40)),
+            error_rate=float(os.getenv('FAKE_LLM_ERROR_RATE', 0)),
+            seed=int(os.getenv('FAKE_LLM_SEED', 0)),
+            prefill_tokens_per_second=float(os.getenv('FAKE_LLM_PREFILL_TOKENS_PER_SEC', 0))
+        )
+    raise ValueError(f"Unknown LLM_PROVIDER: {name}")
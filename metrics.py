@@ -0,0 +1,128 @@
+"""In-process metrics: timing spans, token counters and Prometheus text output.
+
+Metrics are per process; with several gunicorn workers each scrape of
+/metrics sees the worker that served it. LOG_FORMAT=json also writes every
+span as a structured log line on stdout.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+JSON_LOGS = os.getenv('LOG_FORMAT', '').lower() == 'json'
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry['buckets']):
+                    lines.append(f'{self.name}_bucket{_format_labels(key, [("le", bound)])} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", "+Inf")])} {entry["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {entry["sum"]}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {entry["count"]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('meic_http_request_seconds', 'HTTP request latency by endpoint and status.')
+SPAN_SECONDS = Histogram('meic_span_seconds', 'Duration of instrumented steps within a request.')
+TIME_TO_FIRST_TOKEN = Histogram('meic_llm_time_to_first_token_seconds', 'Time to the first streamed chunk.')
+LLM_TOKENS = Counter('meic_llm_tokens_total', 'Tokens reported by the LLM provider, by operation and kind.')
+LLM_ERRORS = Counter('meic_llm_errors_total', 'Failed LLM calls by operation.')
+CONTEXT_CACHE = Counter('meic_llm_context_cache_total', 'Context cache lookups by outcome.')
+SINGLEFLIGHT_SHARED = Counter('meic_singleflight_shared_total', 'Calls answered by an identical call already in flight.')
+
+REGISTRY = [REQUEST_SECONDS, SPAN_SECONDS, TIME_TO_FIRST_TOKEN, LLM_TOKENS, LLM_ERRORS, CONTEXT_CACHE,
+            SINGLEFLIGHT_SHARED]
+
+
+def log_event(event, **fields):
+    if JSON_LOGS:
+        print(json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}), flush=True)
+
+
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, error=error, **labels)
+
+
+def record_span(name, seconds, error=None, **labels):
+    # For steps timed elsewhere, such as in a PDF renderer process
+    SPAN_SECONDS.observe(seconds, span=name, **labels)
+    log_event('span', span=name, ms=round(seconds * 1000, 2), error=error, **labels)
+
+
+def record_usage(operation, usage):
+    for kind in ('prompt_tokens', 'response_tokens', 'cached_tokens'):
+        if usage.get(kind):
+            LLM_TOKENS.inc(usage[kind], operation=operation, kind=kind.replace('_tokens', ''))
+    if usage:
+        log_event('llm_usage', operation=operation, **usage)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,97 @@
+"""Renders PDF reports in a small pool of worker processes.
+
+Building the report tables with ReportLab is CPU-bound and holds the GIL,
+so rendering inline stalls every other request in the same worker.
+PDFRenderer sends the conversation and feedback (plain data) to a process
+pool and waits for the PDF bytes, which leaves the GIL free for other
+requests while the report is built.
+
+The pool is bounded: `workers` reports render at once and up to `queue`
+more wait for a free process. Beyond that render() raises
+PDFRendererBusyError straight away instead of piling up work, and a report
+not finished within `timeout` seconds raises PDFRenderTimeoutError.
+workers=0 renders inline as before.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import record_span
+from pdf_report import render_pdf_bytes
+
+
+class PDFRendererBusyError(RuntimeError):
+    """Every renderer process is busy and the queue is full."""
+
+
+class PDFRenderTimeoutError(RuntimeError):
+    """A report took longer than the renderer's timeout."""
+
+
+class PDFRenderer:
+    def __init__(self, workers=2, queue=64, timeout=30):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue) if workers else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv('PDF_WORKERS', 2)),
+            queue=int(os.getenv('PDF_QUEUE', 64)),
+            timeout=float(os.getenv('PDF_TIMEOUT', 30))
+        )
+
+    def _pool(self):
+        # Started on first use, so each gunicorn worker gets its own pool.
+        # spawn rather than fork: forking a process with running threads can
+        # copy a lock another thread is holding into the child.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _discard(self, executor):
+        # A renderer process died (e.g. killed for memory); start a fresh pool next time
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, conversation, feedback):
+        pdf_bytes, build_seconds = self._render(conversation, feedback)
+        record_span('pdf_build', build_seconds)
+        return pdf_bytes
+
+    def _render(self, conversation, feedback):
+        if not self.workers:
+            return render_pdf_bytes(conversation, feedback)
+        if not self._slots.acquire(blocking=False):
+            raise PDFRendererBusyError('Too many reports are being generated, please try again shortly')
+        executor = None
+        try:
+            executor = self._pool()
+            future = executor.submit(render_pdf_bytes, conversation, feedback)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            raise
+        # The slot is freed when rendering ends, even if the request stopped waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Only takes effect if it hadn't started; otherwise it finishes unseen
+            future.cancel()
+            raise PDFRenderTimeoutError(f'The report took longer than {self.timeout:g}s to generate')
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
@@ -0,0 +1,181 @@
+"""PDF export of a training conversation and its feedback.
+
+Styles, colours and table styles are built once per process in a
+ReportTemplate and shared by every PDF. render_pdf_bytes() is the entry
+point for the renderer processes in pdf_renderer.py.
+"""
+import time
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from metrics import record_span
+
+MEIC_PURPLE = colors.Color(151/255, 65/255, 146/255)
+MEIC_LAVENDER = colors.Color(225/255, 164/255, 228/255)
+
+FEEDBACK_ROWS = [
+    ('Tone of Voice', 'tone'),
+    ('Engagement', 'engagement'),
+    ('Resolution', 'resolution'),
+    ('Information Provided', 'information'),
+    ('Overall', 'overall'),
+]
+
+
+class ReportTemplate:
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.normal = styles['Normal']
+        self.title = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
+            textColor=MEIC_PURPLE,
+            spaceAfter=10
+        )
+        self.subtitle = ParagraphStyle(
+            'CustomSubtitle',
+            parent=styles['Normal'],
+            fontSize=12,
+            textColor=colors.grey,
+            spaceAfter=30
+        )
+        self.section = ParagraphStyle(
+            'SectionHeading',
+            parent=styles['Heading2'],
+            fontSize=14,
+            textColor=MEIC_PURPLE,
+            spaceAfter=12
+        )
+        # Header row in grey, body rows in Meic lavender; used by both tables
+        self.table = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), MEIC_LAVENDER),
+            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 1), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 6),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+            ('TOPPADDING', (0, 0), (-1, -1), 6),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6)
+        ])
+        self.conversation_widths = [1.5*inch, 4.5*inch]
+        self.feedback_widths = [2*inch, 1*inch, 3*inch]
+
+
+@lru_cache(maxsize=None)
+def get_report_template():
+    return ReportTemplate()
+
+
+def create_pdf(conversation, feedback, template=None):
+    buffer, build_seconds = _build_pdf(conversation, feedback, template)
+    record_span('pdf_build', build_seconds)
+    return buffer
+
+
+def _build_pdf(conversation, feedback, template=None):
+    # Returns the PDF buffer and the seconds doc.build() took
+    try:
+        template = template or get_report_template()
+        buffer = BytesIO()
+        # Add margins to the document
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=letter,
+            leftMargin=50,
+            rightMargin=50,
+            topMargin=50,
+            bottomMargin=50
+        )
+        story = []
+
+        # Get current date and time
+        current_datetime = datetime.now().strftime("%d %B %Y, %H:%M")
+
+        story.append(Paragraph("Chat Conversation and Feedback", template.title))
+        story.append(Paragraph(f"Generated on: {current_datetime}", template.subtitle))
+
+        # Add conversation summary
+        story.append(Paragraph("Conversation Summary:", template.section))
+        story.append(Paragraph(feedback.get('conversation_summary', ''), template.normal))
+        story.append(Spacer(1, 20))
+
+        # Add persona details
+        story.append(Paragraph("About Young Person:", template.section))
+        persona = feedback.get('persona', {})
+        if persona:
+            persona_details = [
+                f"Age: {persona.get('age', '')}",
+                f"Gender: {persona.get('gender', {}).get('identity', '')}",
+                f"Location: {persona.get('location', '')}",
+                f"Education: {persona.get('education', {}).get('details', '')}",
+                f"Welsh Background: {persona.get('welsh_family', '')}, attends a {persona.get('welsh_school', '')}, interested in {persona.get('welsh_interest', '')}",
+                f"Issue: {persona.get('issue', '')}",
+                f"Desired Outcome: {persona.get('outcome', '')}"
+            ]
+            for detail in persona_details:
+                story.append(Paragraph(detail, template.normal))
+        story.append(Spacer(1, 20))
+
+        # Add conversation
+        story.append(Paragraph("Conversation:", template.section))
+        story.append(Spacer(1, 12))
+
+        # Create conversation table with wrapped text
+        conv_data = [['Role', 'Message']]
+        for msg in conversation:
+            # Convert message content to Paragraph for word wrapping
+            conv_data.append([msg['role'], Paragraph(msg['content'], template.normal)])
+
+        conv_table = Table(conv_data, colWidths=template.conversation_widths)
+        conv_table.setStyle(template.table)
+        story.append(conv_table)
+        story.append(Spacer(1, 20))
+
+        # Add feedback
+        story.append(Paragraph("Feedback:", template.section))
+        story.append(Spacer(1, 12))
+
+        # Create feedback table with wrapped text
+        feedback_data = [['Category', 'Score', 'Feedback']]
+        for label, key in FEEDBACK_ROWS:
+            feedback_data.append([label, feedback[key]['score'], Paragraph(feedback[key]['feedback'], template.normal)])
+
+        feedback_table = Table(feedback_data, colWidths=template.feedback_widths)
+        feedback_table.setStyle(template.table)
+        story.append(feedback_table)
+
+        # Build PDF
+        start = time.perf_counter()
+        doc.build(story)
+        build_seconds = time.perf_counter() - start
+        buffer.seek(0)
+        return buffer, build_seconds
+    except Exception as e:
+        print(f"Error in create_pdf: {str(e)}")
+        raise
+
+
+def render_pdf_bytes(conversation, feedback):
+    """create_pdf() with plain data in and plain data out, so it can run in another process.
+
+    Returns the PDF bytes and the doc.build() time, which the caller records:
+    metrics recorded in a renderer process would never reach /metrics.
+    """
+    buffer, build_seconds = _build_pdf(conversation, feedback)
+    return buffer.getvalue(), build_seconds
@@ -0,0 +1,62 @@
+"""Bounded pool of ready-made persona bundles, topped up in the background.
+
+Bundles are kept in one bucket per key (the persona theme), so a caller can
+ask for a bundle of a particular theme. The refill thread always tops up the
+emptiest bucket first.
+"""
+import queue
+import threading
+import time
+
+
+class PersonaPool:
+    def __init__(self, make_bundle, make_fallback=None, size=8, retry_delay=5, keys=(None,)):
+        # make_bundle(key) builds a full bundle on the refill thread (it may
+        # call Gemini); make_fallback(key) builds a cheap one inline when the
+        # bucket is empty. size is per bucket.
+        self._make_bundle = make_bundle
+        self._make_fallback = make_fallback or make_bundle
+        self._queues = {key: queue.Queue(maxsize=size) for key in keys}
+        self._retry_delay = retry_delay
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refill, name='persona-pool', daemon=True)
+                self._thread.start()
+
+    def _emptiest(self):
+        key, q = min(self._queues.items(), key=lambda item: item[1].qsize())
+        return None if q.full() else (key,)
+
+    def _refill(self):
+        while True:
+            # Cleared before checking, so a take() in between is not missed
+            self._wakeup.clear()
+            found = self._emptiest()
+            if found is None:
+                self._wakeup.wait()
+                continue
+            key = found[0]
+            try:
+                bundle = self._make_bundle(key)
+            except Exception as e:
+                print(f"Error building persona bundle: {str(e)}")
+                time.sleep(self._retry_delay)
+                continue
+            # Only this thread adds bundles, so the bucket still has room
+            self._queues[key].put_nowait(bundle)
+
+    def take(self, key=None):
+        try:
+            bundle = self._queues[key].get_nowait()
+        except queue.Empty:
+            bundle = self._make_fallback(key)
+        self._wakeup.set()
+        return bundle
+
+    def __len__(self):
+        return sum(q.qsize() for q in self._queues.values())
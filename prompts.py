@@ -0,0 +1,228 @@
+"""Prompt templates for the persona chat, history summaries and analysis.
+
+Each template is compiled once at import into literal text and field names,
+and identified by a hash of its source. Prompts are rendered from persona
+fields when needed instead of being stored, and the version goes into the
+analysis cache key, so editing a template invalidates exactly the results
+it produced.
+"""
+import hashlib
+from string import Formatter
+
+
+class PromptTemplate:
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.version = hashlib.sha256(source.encode()).hexdigest()[:12]
+        self._parts = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if spec or conversion:
+                raise ValueError(f"Template {name} uses a format spec on {{{field}}}; pass plain fields")
+            self._parts.append((literal, field))
+        self.fields = frozenset(field for _, field in self._parts if field)
+
+    def render(self, **values):
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Template {self.name} is missing {', '.join(sorted(missing))}")
+        return ''.join(literal + (str(values[field]) if field else '') for literal, field in self._parts)
+
+
+def persona_fields(persona):
+    """Flatten a persona dict into the fields the templates use."""
+    return {
+        'age': persona['age'],
+        'gender_identity': persona['gender']['identity'],
+        'gender_pronouns': persona['gender'].get('pronouns', ''),
+        'location': persona['location'],
+        'theme': persona['theme'],
+        'issue': persona['issue'],
+        'outcome': persona['outcome'],
+        'education_details': persona['education']['details'],
+        'welsh_family': persona['welsh_family'],
+        'welsh_school': persona['welsh_school'],
+        'welsh_interest': persona['welsh_interest'],
+        'youth_interest': persona['youth_interest'],
+        'youth_interest_category': persona['youth_interest_category'],
+    }
+
+
+PERSONA_SYSTEM = PromptTemplate('persona_system', """You are role-playing as a {age} year old {gender_identity} from {location} 
+who is contacting the Meic Cymru helpline.
+
+Background:
+- {education_details}
+- From a {welsh_family}
+- Attends a {welsh_school}
+- Interested in {welsh_interest} (Welsh culture)
+- Also interested in {youth_interest} ({youth_interest_category})
+
+Your situation:
+- You are experiencing: {issue}
+- Your desired outcome is: {outcome}
+- You should NOT immediately reveal your desired outcome
+- Let the advisor help you work through your feelings and find solutions
+
+As the young person:
+1. Use {gender_pronouns} pronouns
+2. Keep messages short and natural (1-2 sentences max)
+3. Start by explaining your issue but don't share everything at once
+4. Use informal language appropriate for your age
+5. Use some Welsh words or phrases occasionally (but keep it natural)
+6. Reference your Welsh background and interests naturally
+7. Consider your education context when discussing issues
+8. If asked about your issue, share more details gradually
+9. If asked how you're feeling, describe your emotions honestly
+10. If asked about your background, mention your school, family, or interests
+11. If given advice, respond to it and share your thoughts
+12. If asked to elaborate, provide more details
+13. NEVER repeat the same phrase or response
+14. ALWAYS provide new information in each message
+15. If the advisor helps you reach your desired outcome, you can say goodbye
+16. Remember to be natural and human-like in your responses
+
+Remember you are a young person seeking help, not a counselor or advisor.
+Your responses should be brief and reflect the perspective and language of a young person in Wales.
+Start by explaining your issue and then respond naturally to the advisor's questions.""")
+
+SUMMARY = PromptTemplate('summary', """Summarise this part of a conversation between a Meic Cymru helpline advisor and a young person
+in 3-5 sentences. Keep what the young person has already shared and any advice they were given.
+
+{earlier_summary}
+
+{conversation}""")
+
+# The analysis is split into a fixed rubric, sent as the system instruction
+# (a static prefix that can be context-cached), and a per-conversation request
+ANALYSIS_REQUEST = PromptTemplate('analysis_request', """Analyze this conversation between a Meic Cymru helpline advisor and a {age} year old {gender_identity} from {location} 
+who is contacting about an issue related to {theme}.
+
+Conversation:
+{conversation}
+""")
+
+# Rolling evaluation: the synthesis gets per-exchange notes instead of the
+# transcript, and is sent with the same rubric as a full analysis
+ANALYSIS_NOTES_REQUEST = PromptTemplate('analysis_notes_request', """Analyze this conversation between a Meic Cymru helpline advisor and a {age} year old {gender_identity} from {location}
+who is contacting about an issue related to {theme}.
+
+Instead of the full transcript you have notes written after each exchange, with scores for that exchange.
+Exchanges without notes are given in full. Base your evaluation and examples on these, judging how the
+advisor did across the whole conversation rather than averaging the per-exchange scores.
+
+{notes}
+""")
+
+TURN_NOTE_RUBRIC = PromptTemplate('turn_note_rubric', """You are observing a training conversation between a Meic Cymru helpline advisor and a young person,
+one exchange at a time.
+
+For the latest exchange only (the advisor's message and the young person's reply), provide:
+- summary: one sentence on what happened in this exchange
+- tone, engagement, resolution and information: a 0-100 score for how the advisor did in this exchange,
+  with feedback of at most 15 words that refers to what they said
+
+Tone of Voice: friendly, approachable, professional yet empathetic, patient.
+Engagement: active listening, appropriate follow-up questions, letting the young person express themselves.
+Resolution: working towards the issue, suggesting solutions or next steps.
+Information Provided: relevant services or resources, appropriate to the young person's situation, clearly explained.
+
+Early exchanges may not call for solutions or information yet; score those on whether the advisor's
+approach was right for that point in the conversation.
+
+Provide your notes as JSON.""")
+
+TURN_NOTE_REQUEST = PromptTemplate('turn_note_request', """The young person is a {age} year old {gender_identity} from {location}, contacting about an issue related to {theme}.
+
+{previous_exchange}
+
+Latest exchange (number {turn}):
+{exchange}""")
+
+# Criteria for each scored dimension, shared by the full rubric and the
+# per-dimension rubrics used when the analysis is fanned out
+DIMENSIONS = {
+    'tone': ('Tone of Voice', """- Was the advisor friendly and approachable?
+- Did they maintain a professional yet empathetic tone?
+- Were they patient and understanding?"""),
+    'engagement': ('Engagement', """- Did the advisor actively listen to the young person?
+- Did they ask appropriate follow-up questions?
+- Did they allow the young person to express themselves fully?
+- Did they show genuine interest in the young person's situation?"""),
+    'resolution': ('Resolution', """- Was the issue addressed effectively?
+- Were appropriate solutions or next steps suggested?
+- Was the conversation productive and focused?
+- How quickly was the core issue identified and addressed?"""),
+    'information': ('Information Provided', """- Were relevant services or resources recommended?
+- Was the information appropriate for the young person's location and situation?
+- Were alternative options considered?
+- Was the information clear and understandable?"""),
+}
+
+_EVALUATOR = "You evaluate training conversations between Meic Cymru helpline advisors and young people."
+
+_RUBRIC = _EVALUATOR + """
+
+First, provide a brief summary of the conversation in 2-3 sentences.
+
+Then, provide information about the young person in this format:
+ABOUT_YOUNG_PERSON: [Include age, gender, location, education, Welsh background, and the specific issue they were dealing with]
+
+Then evaluate the advisor's performance in these areas:
+
+""" + "\n\n".join(
+    f"{n}. {label} (0-100):\n{criteria}" for n, (label, criteria) in enumerate(DIMENSIONS.values(), 1)
+) + """
+
+For each category, provide:
+1. A score (0-100)
+2. Specific feedback on what was done well and what could be improved
+3. Examples from the conversation to support your evaluation
+"""
+
+# One rubric per output format; each includes the shared instructions above
+ANALYSIS_RUBRIC_JSON = PromptTemplate('analysis_rubric_json', _RUBRIC + """
+Provide your analysis as JSON. Put the 2-3 sentence summary in conversation_summary, the details
+about the young person in about_young_person, and a 0-100 score with feedback for tone, engagement,
+resolution, information and overall.""")
+
+ANALYSIS_RUBRIC_TEXT = PromptTemplate('analysis_rubric_text', _RUBRIC + """
+Provide your analysis in this exact format:
+CONVERSATION_SUMMARY: [2-3 sentence summary]
+
+ABOUT_YOUNG_PERSON: [Details about the young person]
+
+TONE_SCORE: [number]
+TONE_FEEDBACK: [feedback]
+
+ENGAGEMENT_SCORE: [number]
+ENGAGEMENT_FEEDBACK: [feedback]
+
+RESOLUTION_SCORE: [number]
+RESOLUTION_FEEDBACK: [feedback]
+
+INFORMATION_SCORE: [number]
+INFORMATION_FEEDBACK: [feedback]
+
+OVERALL_SCORE: [number]
+OVERALL_FEEDBACK: [feedback]""")
+
+# Fan-out: one small request per dimension plus one for the summary, run
+# concurrently; overall is computed locally from the dimension scores
+DIMENSION_RUBRICS = {
+    key: PromptTemplate(f'analysis_dimension_{key}', _EVALUATOR + f"""
+
+Evaluate only the advisor's {label} (0-100):
+{criteria}
+
+Provide a score (0-100) and specific feedback on what was done well and what could be improved,
+with examples from the conversation. Provide your evaluation as JSON.""")
+    for key, (label, criteria) in DIMENSIONS.items()
+}
+
+SUMMARY_RUBRIC = PromptTemplate('analysis_summary', _EVALUATOR + """
+
+Do not score the conversation. Provide as JSON:
+- conversation_summary: a brief summary of the conversation in 2-3 sentences
+- about_young_person: the young person's age, gender, location, education, Welsh background, and the
+  specific issue they were dealing with""")
@@ -0,0 +1,213 @@
+"""Retries, deadlines, a circuit breaker and a concurrency limit around an LLM provider.
+
+ResilientProvider wraps any LLMProvider:
+
+- each attempt gets a timeout, and all attempts share an overall deadline
+- retryable failures are retried with full-jitter exponential backoff
+- after repeated failures the circuit opens and calls fail fast until the
+  upstream has had time to recover
+- at most max_concurrency calls are in flight per process; callers that
+  can't get a slot within queue_timeout are turned away
+"""
+import os
+import random
+import threading
+import time
+
+from llm import LLMProvider, LLMStream, TransientLLMError
+
+
+class LLMUnavailableError(Exception):
+    """The call was refused without reaching the upstream (circuit open or overloaded)."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+class ConcurrencyLimitError(LLMUnavailableError):
+    pass
+
+
+def _retryable_types():
+    types = [TransientLLMError, TimeoutError, ConnectionError]
+    try:
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:
+        return tuple(types)
+    # ServerError covers every 5xx, including 502 and 504 from the REST
+    # transport; TooManyRequests is its 429
+    types += [
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServerError,
+    ]
+    return tuple(types)
+
+
+RETRYABLE_ERRORS = _retryable_types()
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; lets one trial call
+    through after reset_timeout (half-open) and closes again if it succeeds."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_other(self):
+        """The call ended without a verdict on the upstream's health (e.g. a
+        rejected request): the failure count stands, and a trial call
+        doesn't close the circuit."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class ResilientProvider(LLMProvider):
+    def __init__(self, provider, timeout=30, deadline=60, retries=2, backoff_base=0.5,
+                 backoff_max=8, breaker=None, max_concurrency=32, queue_timeout=10):
+        self.provider = provider
+        self.name = provider.name
+        self.min_cache_tokens = provider.min_cache_tokens
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    @classmethod
+    def from_env(cls, provider):
+        return cls(
+            provider,
+            timeout=float(os.getenv('LLM_TIMEOUT', 30)),
+            deadline=float(os.getenv('LLM_DEADLINE', 60)),
+            retries=int(os.getenv('LLM_RETRIES', 2)),
+            backoff_base=float(os.getenv('LLM_BACKOFF_BASE', 0.5)),
+            backoff_max=float(os.getenv('LLM_BACKOFF_MAX', 8)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', 5)),
+                reset_timeout=float(os.getenv('LLM_BREAKER_RESET', 30))
+            ),
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 32)),
+            queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', 10))
+        )
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ConcurrencyLimitError('Too many model calls in flight, try again shortly')
+
+    def _call(self, attempt_fn):
+        """Run attempt_fn(timeout) with retries; the caller holds a concurrency slot."""
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError('The AI service is having problems, try again shortly')
+            remaining = deadline - time.monotonic()
+            try:
+                result = attempt_fn(min(self.timeout, max(remaining, 0.1)))
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                attempt += 1
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if attempt > self.retries or time.monotonic() + delay >= deadline:
+                    raise
+                print(f"Retrying model call after {type(e).__name__} (attempt {attempt}, {delay:.1f}s)")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Only a valid answer counts as a success, so errors that aren't
+                # retried don't reset the count of failures that were
+                self.breaker.record_other()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def _guarded(self, attempt_fn):
+        self._acquire()
+        try:
+            return self._call(attempt_fn)
+        finally:
+            self._slots.release()
+
+    def generate(self, contents, system_instruction=None, generation_config=None, timeout=None,
+                 cached_content=None):
+        return self._guarded(lambda t: self.provider.generate(
+            contents, system_instruction=system_instruction,
+            generation_config=generation_config, timeout=t, cached_content=cached_content
+        ))
+
+    def create_cache(self, system_instruction, ttl):
+        return self._guarded(lambda t: self.provider.create_cache(system_instruction, ttl))
+
+    def refresh_cache(self, handle, ttl):
+        return self._guarded(lambda t: self.provider.refresh_cache(handle, ttl))
+
+    def stream(self, contents, system_instruction=None, generation_config=None, timeout=None,
+               cached_content=None):
+        def open_stream(t):
+            # Retry only until the first chunk arrives; after that the reply is
+            # already on its way to the browser
+            inner = self.provider.stream(
+                contents, system_instruction=system_instruction,
+                generation_config=generation_config, timeout=t, cached_content=cached_content
+            )
+            chunks = iter(inner)
+            try:
+                first = next(chunks)
+            except StopIteration:
+                first = None
+            return inner, chunks, first
+
+        def chunks(stream):
+            self._acquire()
+            try:
+                inner, rest, first = self._call(open_stream)
+                if first is not None:
+                    yield first
+                    yield from rest
+                stream.usage = inner.usage
+            finally:
+                self._slots.release()
+
+        return LLMStream(chunks)
@@ -0,0 +1,250 @@
+"""Server-side session storage.
+
+The browser cookie only carries a signed, opaque session ID. The persona and
+conversation history live in a pluggable store on the server, so the cookie
+stays the same size however long a training chat runs.
+
+The session ID is signed with the app's secret key. load_secret_keys() reads
+it from SECRET_KEY or SECRET_KEY_FILE so every worker and instance agrees on
+it, and old keys listed in SECRET_KEY_FALLBACKS are still accepted while a
+rotation rolls out.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from cache import LRUCache
+from metrics import span
+
+
+class SessionStore:
+    """Interface for session backends. Data must be JSON-serialisable."""
+
+    def load(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data, new=False):
+        """new is True for a session seen on a single request so far."""
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process store with LRU eviction and idle TTL.
+
+    Sessions that have only been seen once (a page load, a crawler, a
+    cookie-less probe) are kept in their own LRU until they come back, so a
+    burst of them can't evict chats already in progress.
+    """
+
+    def __init__(self, maxsize=1000, ttl=2 * 60 * 60, new_maxsize=None):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._new = LRUCache(maxsize=new_maxsize or maxsize, ttl=ttl)
+
+    def load(self, sid):
+        data = self._cache.get(sid)
+        if data is None:
+            data = self._new.get(sid)
+        # Hand out a copy so a request never mutates another request's view
+        return json.loads(data) if data is not None else None
+
+    def save(self, sid, data, new=False):
+        if new:
+            self._new.set(sid, json.dumps(data))
+            return
+        self._new.pop(sid)
+        self._cache.set(sid, json.dumps(data))
+
+    def delete(self, sid):
+        self._cache.pop(sid)
+        self._new.pop(sid)
+
+
+class SQLiteSessionStore(SessionStore):
+    """File-backed store, shared by every worker process on the host."""
+
+    def __init__(self, path='sessions.db', ttl=2 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._saves = 0
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            'SELECT data, expires FROM sessions WHERE sid = ?', (sid,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= time.time():
+            self.delete(sid)
+            return None
+        return json.loads(row[0])
+
+    def save(self, sid, data, new=False):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                (sid, json.dumps(data), time.time() + self.ttl),
+            )
+        # Sweep expired rows now and then rather than on every write
+        self._saves += 1
+        if self._saves % 100 == 0:
+            self.purge_expired()
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def purge_expired(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),))
+
+
+def _read_key_file(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _local_key(path):
+    # Generated once and shared through the file, so all workers on this
+    # machine sign with the same key. Linking a complete temp file into place
+    # means a worker never reads a half-written key.
+    if not os.path.exists(path):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.secret-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            os.link(tmp_path, path)
+            print(f"Generated a new secret key in {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    return _read_key_file(path)
+
+
+def load_secret_keys():
+    """Return (current key, [old keys still accepted])."""
+    key = os.getenv('SECRET_KEY')
+    if not key and os.getenv('SECRET_KEY_FILE'):
+        key = _read_key_file(os.getenv('SECRET_KEY_FILE'))
+    if not key:
+        path = os.getenv('SECRET_KEY_LOCAL_PATH', '.secret_key')
+        print(f"SECRET_KEY is not set; using the local key in {path} "
+              "(set SECRET_KEY when running more than one instance)")
+        key = _local_key(path)
+    fallbacks = [k.strip() for k in os.getenv('SECRET_KEY_FALLBACKS', '').split(',') if k.strip()]
+    return key, fallbacks
+
+
+def create_session_store(backend=None):
+    backend = backend or os.getenv('SESSION_BACKEND', 'memory')
+    ttl = int(os.getenv('SESSION_TTL', 2 * 60 * 60))
+    if backend == 'memory':
+        return MemorySessionStore(
+            maxsize=int(os.getenv('SESSION_MAX_ENTRIES', 1000)),
+            ttl=ttl,
+            new_maxsize=int(os.getenv('SESSION_MAX_NEW_ENTRIES', 0)) or None
+        )
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path=os.getenv('SESSION_DB_PATH', 'sessions.db'), ttl=ttl)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    salt = 'meic-session'
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        # itsdangerous signs with the last key and accepts any of them
+        keys = list(app.config.get('SECRET_KEY_FALLBACKS') or []) + [app.secret_key]
+        return Signer(keys, salt=self.salt)
+
+    def _new_session(self):
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self._new_session()
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            print("Session cookie has an invalid signature (secret key changed?), starting a new session")
+            return self._new_session()
+        with span('session_load'):
+            data = self.store.load(sid)
+        if data is None:
+            print("Session not found in the store (expired, or not shared between workers), starting a new session")
+            return self._new_session()
+        return ServerSideSession(data, sid=sid)
+
+    def persist(self, session):
+        # For streamed responses: the normal save runs before the body is sent,
+        # so anything written to the session while streaming is saved here.
+        self.store.save(session.sid, dict(session))
+        session.modified = False
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified or session.new:
+            with span('session_save'):
+                self.store.save(session.sid, dict(session), new=session.new)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
@@ -0,0 +1,187 @@
+"""Collapse concurrent identical calls into one.
+
+do(key, fn) runs fn once for any number of callers that arrive with the same
+key while it is in flight; the others wait and get the same result (or the
+same exception). Keys are request fingerprints, so a double-clicked "End
+chat" or a retried /chat makes one Gemini call instead of two.
+
+SingleFlight only sees calls in its own process. SQLiteSingleFlight also
+records in-flight keys in a database file shared by the gunicorn workers: a
+worker that finds the key already running polls until the owner stores the
+result. A finished result is kept only until the workers that were waiting
+have read it, so a later, non-concurrent call still makes its own request.
+Results cross the process boundary as JSON, so callers pass encode/decode
+for anything else. A failure, or a None result such as a failed analysis,
+is not shared across workers; the next duplicate simply tries again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, label=None, encode=None, decode=None):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            metrics.SINGLEFLIGHT_SHARED.inc(operation=label)
+            return future.result()
+
+        try:
+            result = self._run(key, fn, label, encode, decode)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _run(self, key, fn, label, encode, decode):
+        return fn()
+
+
+class SQLiteSingleFlight(SingleFlight):
+    def __init__(self, path='singleflight.db', wait_timeout=120, result_ttl=2, poll_interval=0.1):
+        super().__init__()
+        self.path = path
+        # Also how long a 'running' row is trusted before its owner is presumed dead
+        self.wait_timeout = wait_timeout
+        # Only a backstop for waiters that died before reading the result
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS flights ('
+            'key TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, '
+            'waiters INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, statements):
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock, so reads and writes in here don't interleave
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def _claim(self, key, waiting):
+        """Return None if this worker now owns key, else the existing (status, result).
+
+        A worker that finds the key running is counted as a waiter (once), so
+        the owner knows whether anyone will read its result.
+        """
+        def claim(conn):
+            now = time.time()
+            conn.execute(
+                "DELETE FROM flights WHERE (status = 'done' AND updated < ?) OR updated < ?",
+                (now - self.result_ttl, now - self.wait_timeout)
+            )
+            row = conn.execute('SELECT status, result FROM flights WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO flights (key, status, updated) VALUES (?, 'running', ?)", (key, now))
+            elif not waiting:
+                conn.execute('UPDATE flights SET waiters = waiters + 1 WHERE key = ?', (key,))
+            return row
+        return self._transaction(claim)
+
+    def _stop_waiting(self, key):
+        # The last waiter to leave removes a finished row, so a later call
+        # that wasn't concurrent with this one doesn't get its result
+        def leave(conn):
+            conn.execute('UPDATE flights SET waiters = waiters - 1 WHERE key = ?', (key,))
+            conn.execute("DELETE FROM flights WHERE key = ? AND status = 'done' AND waiters <= 0", (key,))
+        self._transaction(leave)
+
+    def _finish(self, key, encoded):
+        # Published only if another worker is waiting for it; None is never
+        # published (a failed analysis), so waiters go on to try themselves
+        def finish(conn):
+            waiters = conn.execute('SELECT waiters FROM flights WHERE key = ?', (key,)).fetchone()
+            if encoded is None or not waiters or waiters[0] <= 0:
+                conn.execute('DELETE FROM flights WHERE key = ?', (key,))
+            else:
+                conn.execute(
+                    "UPDATE flights SET status = 'done', result = ?, updated = ? WHERE key = ?",
+                    (encoded, time.time(), key)
+                )
+        self._transaction(finish)
+
+    def _run(self, key, fn, label, encode, decode):
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while True:
+            try:
+                row = self._claim(key, waiting)
+            except sqlite3.Error as e:
+                print(f"Single-flight database unavailable ({str(e)}), calling directly")
+                return fn()
+            if row is None:
+                break
+            status, result = row
+            if status == 'done':
+                self._stop_waiting(key)
+                metrics.SINGLEFLIGHT_SHARED.inc(operation=label)
+                value = json.loads(result)
+                return decode(value) if decode else value
+            waiting = True
+            if time.monotonic() >= deadline:
+                self._stop_waiting(key)
+                print(f"Gave up waiting for another worker's {label} call, calling directly")
+                return fn()
+            time.sleep(self.poll_interval)
+
+        try:
+            value = fn()
+        except BaseException:
+            self._finish(key, None)
+            raise
+        encoded = None
+        if value is not None:
+            try:
+                encoded = json.dumps(encode(value) if encode else value)
+            except (TypeError, ValueError) as e:
+                print(f"Could not share {label} result with other workers: {str(e)}")
+        try:
+            self._finish(key, encoded)
+        except sqlite3.Error as e:
+            print(f"Could not share {label} result with other workers: {str(e)}")
+        return value
+
+
+def create_single_flight(backend=None):
+    backend = backend or os.getenv('SINGLEFLIGHT_BACKEND', 'memory')
+    if backend == 'memory':
+        return SingleFlight()
+    if backend == 'sqlite':
+        return SQLiteSingleFlight(
+            path=os.getenv('SINGLEFLIGHT_DB_PATH', 'singleflight.db'),
+            wait_timeout=float(os.getenv('SINGLEFLIGHT_WAIT', 120))
+        )
+    raise ValueError(f"Unknown SINGLEFLIGHT_BACKEND: {backend}")